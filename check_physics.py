@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+#
+# check_physics - Compare the rainballs engines with the original ball math
+#
+#    Copyright (C) 2014 Rodrigo Silva (MestreLion) <linux@rodrigosilva.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. See <http://www.gnu.org/licenses/gpl.html>
+
+""" Check that the engines still do the original math, to the last bit
+
+    Baseline is the Ball update() and collide() of the first rainballs, on
+    euclid vectors. The same random balls run with it and with each engine,
+    sleeping and substeps off, colliding every pair in order. The numpy
+    Physics.solve() batches are checked against Engine.collide() one pair at
+    a time, from the same state. Every difference must be zero.
+"""
+
+import os
+import sys
+import math
+import random
+import argparse
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import numpy as np  # Debian: python-numpy
+from euclid import Vector2  # Pypi: euclid
+
+import rainballs
+from rainballs import GRAVITY, DAMPING, FRICTION, TIMESTEP, SCALE, Ball
+
+
+SIZE = (1600, 900)
+
+# The original velocity threshold
+EPSILON_V = (GRAVITY.magnitude() * TIMESTEP * SCALE / 2.) or 1./(SCALE * 5)
+
+
+class Baseline(object):
+    """ A ball as the first rainballs moved and collided it """
+
+    def __init__(self, radius, position, velocity, elasticity, density=1):
+        self.radius = radius
+        self.elasticity = elasticity
+        self.position = Vector2(*position)
+        self.velocity = Vector2(*velocity)
+        self.mass = math.pi * radius**2 * density / Ball.REFMASS
+        self.bounds = (SIZE[0] - radius, SIZE[1] - radius)
+        self.wallp = Vector2(0, 0)
+
+    @property
+    def on_ground(self):
+        return self.position[1] == self.radius
+
+    def update(self, dt=TIMESTEP):
+        def bounce():
+            self.wallp[i] += self.mass * 2 * self.velocity[i]
+            self.velocity[i] *= -1 * DAMPING[i]
+            if abs(self.velocity[i]) < EPSILON_V:
+                self.velocity[i] = 0
+
+        if self.velocity == [0, 0] and self.on_ground:
+            return
+
+        if not (self.on_ground and self.velocity[1] == 0):
+            self.velocity += GRAVITY * dt
+        self.position += self.velocity * SCALE * dt
+
+        for i in [0, 1]:
+            if self.position[i] < self.radius:
+                self.position[i] = self.radius
+                bounce()
+            elif self.position[i] > self.bounds[i]:
+                self.position[i] = self.bounds[i]
+                bounce()
+            if abs(self.velocity[i]) < EPSILON_V:
+                self.wallp[i] = 0
+
+        if self.on_ground and self.velocity[1] == 0:
+            self.velocity[0] -= math.copysign(min(abs(self.velocity[0]),
+                                                  abs(GRAVITY[1] * FRICTION * dt)),
+                                               self.velocity[0])
+            if abs(self.velocity[0]) < EPSILON_V:
+                self.velocity[0] = 0
+
+    def collide(self, other):
+        if self.position == other.position:
+            return
+        ds = other.position - self.position
+        mag2 = ds.magnitude_squared()
+        radsum = self.radius + other.radius
+        if mag2 >= radsum**2:
+            return
+        dvmag = math.sqrt(mag2)
+        overlap = abs(dvmag - radsum)
+
+        CR = min(self.elasticity, other.elasticity)
+        invmass = 1. / (self.mass + other.mass)
+        normal = ds/dvmag
+        tangent = Vector2(-normal[1], normal[0])
+        uan = self.velocity.project(normal)
+        uat = self.velocity.project(tangent)
+        ubn = other.velocity.project(normal)
+        ubt = other.velocity.project(tangent)
+
+        dvn = ubn - uan
+        pn  = uan * self.mass + ubn * other.mass
+        van = (pn + dvn * other.mass * CR) * invmass
+        vbn = (pn - dvn * self.mass  * CR) * invmass
+        self.velocity  = van + uat
+        other.velocity = vbn + ubt
+
+        self.position += -normal * overlap * other.mass * invmass
+        other.position += normal * overlap * self.mass  * invmass
+
+
+def random_balls(count, seed):
+    """ Ball options of count random balls, as create_balls() draws them """
+    rng = random.Random(seed)
+    high = rainballs.radius
+    vx, vy = rainballs.vel
+    return [dict(radius=rng.randint(10, high), elasticity=rainballs.elast,
+                 position=[rng.randint(100, SIZE[0]-high), rng.randint(100, SIZE[1]-high)],
+                 velocity=[rng.randint(-vx, vx), rng.randint(-vy, vy)])
+            for __ in range(count)]
+
+
+def engine(name, balls):
+    physics = rainballs.ENGINES[name](SIZE, sleep_frames=0, max_substeps=1)
+    for options in balls:
+        Ball(physics, **options)
+    return physics
+
+
+def against_baseline(name, count, frames, seed):
+    """ Largest difference in position and velocity from Baseline, after frames """
+    balls = random_balls(count, seed)
+    physics, baseline = engine(name, balls), [Baseline(**_) for _ in balls]
+    for __ in range(frames):
+        physics.update()
+        for ball in baseline:
+            ball.update()
+        for i in range(count):
+            for j in range(i + 1, count):
+                physics.collide(i, j)
+                baseline[i].collide(baseline[j])
+    return max(abs(physics.get(i, field)[k] - getattr(ball, field)[k])
+               for i, ball in enumerate(baseline)
+               for field in ('position', 'velocity') for k in (0, 1))
+
+
+def batches_against_pairs(count, frames, seed):
+    """ Largest difference between Physics.solve() of each batch and
+        Engine.collide() of its pairs in order, from the same state
+    """
+    physics = engine("numpy", random_balls(count, seed))
+    broadphase = rainballs.SpatialHash(physics)
+    for __ in range(frames):
+        rainballs.advance(physics, broadphase)
+    pairs = list(broadphase.pairs())
+    if not pairs:
+        return 0.
+    worst = 0.
+    I, J = np.array(pairs, dtype=int).T
+    for batch in rainballs.batches(I, J):
+        saved = [getattr(physics, _).copy() for _ in ('position', 'velocity', 'totals')]
+        for k in batch:
+            physics.collide(I[k], J[k])
+        pairwise = physics.position.copy(), physics.velocity.copy()
+        physics.position[:], physics.velocity[:], physics.totals = saved
+        physics.solve(I[batch], J[batch])
+        worst = max(worst, abs(pairwise[0] - physics.position).max(),
+                    abs(pairwise[1] - physics.velocity).max())
+    return worst
+
+
+def main(*argv):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0].strip())
+    parser.add_argument('--balls', type=int, default=40,
+                        help="Balls per run. [Default: %(default)s]")
+    parser.add_argument('--frames', type=int, default=300,
+                        help="Steps per run. [Default: %(default)s]")
+    parser.add_argument('--seeds', type=int, default=3,
+                        help="Runs of each check, seeded 0 and up. [Default: %(default)s]")
+    args = parser.parse_args(argv)
+
+    checks = [("%s engine against baseline" % name,
+               lambda seed, name=name: against_baseline(name, args.balls, args.frames, seed))
+              for name in ("numpy", "python")]
+    checks.append(("numpy batches against pairs",
+                   lambda seed: batches_against_pairs(4 * args.balls, args.frames // 5, seed)))
+    failed = False
+    for title, check in checks:
+        worst = max(check(seed) for seed in range(args.seeds))
+        failed |= worst != 0
+        print("%-32s max difference %g %s" % (title, worst, "FAIL" if worst else "ok"))
+    return not failed
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main(*sys.argv[1:]) else 1)
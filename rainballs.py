@@ -25,10 +25,23 @@
 # - Avoid low-contrast colors against background
 # - Instructions (SHIFT to show/dismiss)
 
+import os
 import sys
+import json
 import math
-from random import randint
-
+import time
+import heapq
+import random
+import argparse
+import colorsys
+import itertools
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+try:
+    import numpy as np  # Debian: python-numpy
+except ImportError:
+    np = None  # Only the python engine and the sprite broad-phase are available
 import pygame  # Debian: python-pygame
 from euclid import Vector2, Point2, Circle  # Pypi: euclid
 
@@ -39,6 +52,11 @@ DEBUG = False
 AUTOPLAY = True
 TRACE = False
 BALLS = 20
+BROADPHASE = "hash"  # See BROADPHASES
+ENGINE = "numpy"     # See ENGINES
+INTEGRATOR = "euler"   # See INTEGRATORS
+NARROWPHASE = "batch"  # "batch" for vectorized conflict-free batches, "pair" for one at a
+                       # time, "impulse" for the iterative contact solver
 
 
 # Colors
@@ -51,20 +69,38 @@ WHITE = (255, 255, 255)
 
 # Render stuff
 SCREEN_SIZE = (1600, 900)  # Fullscreen ignores this and always use desktop resolution
-FPS = 60                   # 0 for unbounded
+FPS = 60                   # Render rate, 0 for unbounded
 BG_COLOR = WHITE
+STAMP_BUDGET = 32         # Memory of cached ball images, in MB. The last frame's are kept over it
+COLORING = "ball"         # Ball colors: "ball", or palette-indexed "speed" or "energy"
+SPEED_MAX = 8             # Speed with the hottest color
+ENERGY_MAX = 2500         # Kinetic energy with the hottest color
+DIRTY_MAX = 0.5           # Dirty screen fraction above which the whole screen is updated
+IDLE_WAKE = 1000          # Wake-up timer when idle, in ms
+WAKEUP = pygame.USEREVENT
 
 
 # Physics stuff - Units in pixels/second
 GRAVITY = Vector2(0, -2)
 DAMPING = (0.8, 0.8)      # Velocity restitution coefficient of collisions on boundaries
 FRICTION = 0.1            # Kinetic coefficient of friction
-TIMESTEP = 1./FPS         # dt of physics simulation. Later to be FPS-independent
+HZ = 60                   # Physics steps per second, independent of FPS
+TIMESTEP = 1./HZ          # dt of physics simulation
+MAX_STEPS = 5             # Physics steps per frame. Slower machines lose simulated time
 SCALE = 100               # Velocity scale: how many pixels per second is 1 speed
+SKIN = 20                 # Margin of Verlet neighbour lists, in pixels
+CCD_FRACTION = 1.         # Fraction of the smallest radius a ball may move in a step
+MAX_SUBSTEPS = 16         # Substeps per step of balls moving faster than that
+ITERATIONS = 10           # Maximum contact solver iterations per step
+SLOP = 0.5                # Overlap left uncorrected by the contact solver, in pixels
+DRIFT_HZ = (30, 60, 120, 240)  # Step rates of the integrator benchmark
+DRIFT_MAX = 0.01          # Relative energy drift per simulated second still deemed stable
 
 # Thresholds
-EPSILON_V = (GRAVITY.magnitude() * TIMESTEP * SCALE / 2.) or 1./(SCALE * 5) # Velocity
 EPSILON = 10**(-7)  # General floating point
+SLEEP_FRAMES = 30   # Frames under Physics.epsilon_v before a ball sleeps. 0 disables sleeping
+SLEEP_GAP = 1       # Distance up to which sleeping balls count as touching, in pixels
+RECOMPUTE = 600     # Updates between full recomputes of the energy and momentum totals
 
 
 # Balls maximum values
@@ -73,55 +109,2055 @@ vel = [3, 3]
 elast = 1
 
 
-# Some singletons
-args = None
+# Display singletons. Simulations live in World objects
 screen = None
+stamps = None
+palette = None
+renderer = None
 background = None
-balls = None
 
-if sys.version_info[0] < 3:
-    class FileNotFoundError(Exception):
+
+class Stats(object):
+    """ Hot path counters, cheap enough to be always on
+
+        Counters add up until reset(), which main() calls every frame, so
+        they hold the totals of the physics steps of the last frame.
+    """
+
+    COUNTERS = (
+        ('updated',    "balls updated"),
+        ('skipped',    "balls resting on the ground"),
+        ('asleep',     "balls asleep"),
+        ('bounces',    "wall bounces"),
+        ('candidates', "broad-phase pairs"),
+        ('false',      "false positives in Ball.collide"),
+        ('collisions', "collisions resolved"),
+        ('overlap',    "total overlap corrected, in pixels"),
+        ('iterations', "contact solver iterations"),
+        ('substeps',   "substeps of fast balls"),
+        ('clamp',      "potential energy added by clamping balls onto the walls"),
+    )
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        for name, __ in self.COUNTERS:
+            setattr(self, name, 0)
+
+    def asdict(self):
+        return dict((name, getattr(self, name)) for name, __ in self.COUNTERS)
+
+    def __str__(self):
+        return ("Updated: %d (%d resting, %d asleep), Bounces: %d, "
+                "Pairs: %d (%d false), Collisions: %d, Overlap: %.1f, Iterations: %d, "
+                "Substeps: %d, Clamp: %.1f" % (
+                self.updated, self.skipped, self.asleep, self.bounces,
+                self.candidates, self.false, self.collisions, self.overlap,
+                self.iterations, self.substeps, self.clamp))
+
+
+class Engine(object):
+    """ What the physics engines share: ball sprites, counters and collision math
+
+        Each engine keeps ball state in its own layout. Ball and collide()
+        reach it by index with get(), set() and move(), or as a BallState of
+        scalar floats with state() and store().
+    """
+
+    events = False  # Whether update() resolves collisions itself
+
+    def configure(self, narrowphase=None, sleep_frames=None, skin=None, ccd_fraction=None,
+                  max_substeps=None, iterations=None, slop=None, debug=None):
+        """ Set the tuning options, defaulting to the module globals of the same name """
+        self.narrowphase  = NARROWPHASE  if narrowphase  is None else narrowphase
+        self.sleep_frames = SLEEP_FRAMES if sleep_frames is None else sleep_frames
+        self.skin         = SKIN         if skin         is None else skin
+        self.ccd_fraction = CCD_FRACTION if ccd_fraction is None else ccd_fraction
+        self.max_substeps = MAX_SUBSTEPS if max_substeps is None else max_substeps
+        self.iterations   = ITERATIONS   if iterations   is None else iterations
+        self.slop         = SLOP         if slop         is None else slop
+        self.debug        = DEBUG        if debug        is None else debug
+
+    def __len__(self):
+        return len(self.balls)
+
+    @property
+    def energy(self):
+        return self.totals[0] + self.totals[1]
+
+    @property
+    def momentum(self):
+        return self.totals[2:]
+
+    def gravity_of(self, i):
+        """ Gravity acting on ball i """
+        return self.gravity
+
+    def resolve(self, pairs):
+        """ Resolve the collisions of candidate pairs one by one. Return how many """
+        count = 0
+        for i, j in pairs:
+            self.collide(i, j)
+            count += 1
+        return count
+
+    def collide(self, i, j):
+        """ Resolve the collision of balls i and j, if they actually touch """
+        a, b = self.state(i), self.state(j)
+
+        # Do nothing when centers coincide
+        if a.x == b.x and a.y == b.y:
+            return
+
+        # Calculate the distance vector and its magnitude squared
+        dsx, dsy = b.x - a.x, b.y - a.y
+        mag2 = dsx ** 2 + dsy ** 2
+
+        # Check for false positives from rect collision detection
+        # by testing if distance^2 >= (sum of radii)^2
+        radsum = a.radius + b.radius
+        if mag2 >= radsum**2:
+            self.stats.false += 1
+            self.balls[i].printdata("False Positive")
+            return
+
+        # Calculate the distance vector magnitude (= the distance between the balls)
+        # Also calculate the overlap width (= distance - sum of radii)
+        dvmag = math.sqrt(mag2)
+        overlap = abs(dvmag - radsum)
+
+        self.stats.collisions += 1
+        self.stats.overlap += overlap
+        self.contacts.append((i, j))
+
+        # A real contact wakes both balls, and whatever pile they rest on
+        if a.asleep or b.asleep:
+            for k in (i, j):
+                if self.get(k, 'asleep'):
+                    self.wake(k)
+
+        if self.debug:
+            print("collide! %r %r at %s, %.2f overlap" % (
+                self.balls[i].color, self.balls[j].color, Vector2(a.x, a.y), overlap))
+
+        before = self.entry(i), self.entry(j)
+
+        # Calculate the normal, the unit vector from centers to collision point
+        # It always points in direction from a towards b
+        nx, ny = dsx / dvmag, dsy / dvmag
+        restitution(a, b, nx, ny)
+
+        # Move circles away at normal direction
+        # Each ball is displaced a fraction of offset inversely proportional to its mass
+        am, bm = a.mass, b.mass
+        invmass = 1. / (am + bm)
+        a.x += -nx * overlap * bm * invmass
+        a.y += -ny * overlap * bm * invmass
+        b.x += nx * overlap * am * invmass
+        b.y += ny * overlap * am * invmass
+
+        self.store(i, a)
+        self.store(j, b)
+        self.book(before[0], self.entry(i))
+        self.book(before[1], self.entry(j))
+
+
+def restitution(a, b, nx, ny):
+    """ Update the velocities of colliding BallStates a and b
+
+        (nx, ny) is the normal, the unit vector from a towards b. Momentum is
+        conserved, and the normal relative speed scaled by the lowest
+        elasticity.
+    """
+    # Some constants
+    am, bm = a.mass, b.mass
+    CR = min(a.elasticity, b.elasticity)
+    invmass = 1. / (am + bm)
+
+    # Project the velocities along the normal and its 90º rotation, the tangent.
+    # Both have the same norm d, not quite 1 after rounding
+    d = math.sqrt(nx ** 2 + ny ** 2)
+    uanx, uany = project(a.vx, a.vy,  nx, ny, d)
+    uatx, uaty = project(a.vx, a.vy, -ny, nx, d)
+    ubnx, ubny = project(b.vx, b.vy,  nx, ny, d)
+    ubtx, ubty = project(b.vx, b.vy, -ny, nx, d)
+
+    # Apply momentum conservation for inelastic collision along the normal components
+    # See https://en.wikipedia.org/wiki/Coefficient_of_restitution#Equation
+    dvnx, dvny = ubnx - uanx, ubny - uany
+    pnx, pny = uanx * am + ubnx * bm, uany * am + ubny * bm
+
+    # Update the velocities, adding normal and tangent components
+    a.vx = (pnx + dvnx * bm * CR) * invmass + uatx
+    a.vy = (pny + dvny * bm * CR) * invmass + uaty
+    b.vx = (pnx - dvnx * am * CR) * invmass + ubtx
+    b.vy = (pny - dvny * am * CR) * invmass + ubty
+
+
+def project(x, y, nx, ny, d):
+    """ Projection of (x, y) along (nx, ny) of norm d, rounded as euclid's
+        Vector2.project(). Works on arrays of components too
+    """
+    nx, ny = nx / d, ny / d
+    dot = x * nx + y * ny
+    return nx * dot, ny * dot
+
+
+def batches(I, J):
+    """ Split pairs (I, J) into batches where no ball appears twice
+
+        Greedy graph colouring: in turn, each pair takes the lowest batch
+        neither of its balls is in yet. Returns arrays of pair indexes, one
+        per batch, each in the original pair order.
+    """
+    used = {}  # Batches of each ball, as a bit mask
+    colors = []
+    for i, j in zip(I.tolist(), J.tolist()):
+        mask = used.get(i, 0) | used.get(j, 0)
+        color = (~mask & (mask + 1)).bit_length() - 1  # Lowest bit not set
+        used[i] = used.get(i, 0) | 1 << color
+        used[j] = used.get(j, 0) | 1 << color
+        colors.append(color)
+    order = np.argsort(colors, kind='stable')
+    return np.split(order, np.cumsum(np.bincount(colors))[:-1])
+
+
+def euler(x, v, a, dt):
+    """ Semi-implicit (symplectic) Euler, the original scheme: velocity first,
+        then position with the new velocity
+    """
+    v = v + a * dt
+    return x + v * SCALE * dt, v
+
+
+def explicit(x, v, a, dt):
+    """ Explicit Euler: position with the old velocity. Not symplectic, it gains
+        energy steadily, and is here for comparison
+    """
+    return x + v * SCALE * dt, v + a * dt
+
+
+def verlet(x, v, a, dt):
+    """ Velocity Verlet. Exact for a constant acceleration """
+    return x + (v * dt + a * dt * dt / 2.) * SCALE, v + a * dt
+
+
+def rk4(x, v, a, dt):
+    """ Classic 4th order Runge-Kutta, as a reference. With the constant
+        acceleration of gravity it follows the same parabola as verlet()
+    """
+    k1x, k1v = v * SCALE, a
+    k2x, k2v = (v + k1v * dt / 2.) * SCALE, a
+    k3x, k3v = (v + k2v * dt / 2.) * SCALE, a
+    k4x, k4v = (v + k3v * dt) * SCALE, a
+    return (x + dt / 6. * (k1x + 2 * k2x + 2 * k3x + k4x),
+            v + dt / 6. * (k1v + 2 * k2v + 2 * k3v + k4v))
+
+
+# Integrators of one axis: (position, velocity, acceleration, dt) to the
+# new (position, velocity). They take floats or arrays
+INTEGRATORS = {
+    "euler":    euler,
+    "explicit": explicit,
+    "verlet":   verlet,
+    "rk4":      rk4,
+}
+
+
+class Physics(Engine):
+    """ Ball state as contiguous arrays, one row per ball
+
+        Positions, velocities and wall momenta are (n, 2) arrays, radii,
+        masses and elasticities are (n,) arrays. Ball sprites are thin views
+        over a row, and the whole update step runs as vectorized passes.
+    """
+
+    # Per-ball arrays: name, row shape, dtype
+    FIELDS = (
+        ('position',   (2,), float),
+        ('previous',   (2,), float),  # Position before the last update
+        ('velocity',   (2,), float),
+        ('wallp',      (2,), float),
+        ('bounds',     (2,), float),
+        ('radius',     (),   float),
+        ('mass',       (),   float),
+        ('elasticity', (),   float),
+        ('still',      (),   int),   # Consecutive frames slower than epsilon_v
+        ('asleep',     (),   bool),
+    )
+
+    def __init__(self, size, gravity=None, damping=None, friction=None, integrator=None,
+                 timestep=None, capacity=64, **options):
+        self.configure(**options)
+        self.size = tuple(size)
+        self.gravity  = tuple(GRAVITY if gravity  is None else gravity)
+        self.damping  = tuple(DAMPING if damping  is None else damping)
+        self.friction = FRICTION      if friction is None else friction
+        self.integrator = INTEGRATOR  if integrator is None else integrator
+        self.timestep   = TIMESTEP    if timestep   is None else timestep
+        self.balls = []
+        self.stats = Stats()
+        self.steps = 0
+        self.solver = None  # ImpulseSolver, created on the first resolve()
+        self.contacts = []  # Pairs (i, j), or index arrays (I, J), that collided since sleep()
+        self.touching = np.zeros((0, 3), dtype=int)  # (i, j, step) of the recent contacts
+
+        # Running totals of kinetic energy, potential energy and momentum (x, y),
+        # wall momentum included. Kept by deltas, recomputed every RECOMPUTE updates
+        self.totals = np.zeros(4)
+
+        # Velocity threshold
+        self.epsilon_v = ((math.hypot(*self.gravity) * self.timestep * SCALE / 2.) or
+                          1./(SCALE * 5))
+        for name, shape, dtype in self.FIELDS:
+            setattr(self, '_' + name, np.zeros((capacity,) + shape, dtype=dtype))
+        self._views()
+
+    def _views(self):
+        # Public attributes are views over the first len() rows of the buffers
+        n = len(self.balls)
+        for name, __, __ in self.FIELDS:
+            setattr(self, name, getattr(self, '_' + name)[:n])
+
+    def _grow(self):
+        for name, __, __ in self.FIELDS:
+            old = getattr(self, '_' + name)
+            new = np.zeros((2 * len(old),) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, '_' + name, new)
+
+    def add(self, ball, position, velocity):
+        """ Append a row for ball and return its index """
+        i = len(self.balls)
+        if i == len(self._radius):
+            self._grow()
+        self.balls.append(ball)
+        self._views()
+        self.position[i]   = position
+        self.previous[i]   = position
+        self.velocity[i]   = velocity
+        self.radius[i]     = ball.radius
+        self.mass[i]       = ball.mass
+        self.elasticity[i] = ball.elasticity
+        self.bounds[i]     = (self.size[0] - ball.radius,
+                              self.size[1] - ball.radius)
+        self.totals += self.entry(i)
+        return i
+
+    def entry(self, i):
+        """ Kinetic energy, potential energy and momentum (x, y) of ball i """
+        m, r = float(self.mass[i]), float(self.radius[i])
+        (__, y), (vx, vy), (wx, wy) = (self.position[i].tolist(), self.velocity[i].tolist(),
+                                       self.wallp[i].tolist())
+        return (m * (vx*vx + vy*vy) / 2., m * abs(self.gravity[1]) * (y - r),
+                m * vx + wx, m * vy + wy)
+
+    def ledger(self, rows):
+        """ Sums of entry() over rows, a mask or an index array """
+        m, v = self.mass[rows], self.velocity[rows]
+        return np.hstack((np.dot(m, (v**2).sum(axis=1)) / 2.,
+                          abs(self.gravity[1]) * np.dot(m, self.position[rows, 1] -
+                                                           self.radius[rows]),
+                          np.dot(m, v) + self.wallp[rows].sum(axis=0)))
+
+    def book(self, before, after):
+        self.totals += np.subtract(after, before)
+
+    def get(self, i, name):
+        return getattr(self, name)[i].tolist()
+
+    def set(self, i, name, value):
+        """ Set row i of a state array, keeping the running totals """
+        before = self.entry(i)
+        getattr(self, name)[i] = value
+        self.book(before, self.entry(i))
+
+    def move(self, i, delta):
+        x, y = self.position[i].tolist()
+        x += delta[0]
+        y += delta[1]
+        self.set(i, 'position', (x, y))
+        self.balls[i].rect.center = (int(x), int(self.size[1] - y))
+
+    def state(self, i):
+        """ A BallState copy of row i """
+        return BallState(self.position[i].tolist(), self.velocity[i].tolist(),
+                         float(self.radius[i]), float(self.mass[i]),
+                         float(self.elasticity[i]), asleep=bool(self.asleep[i]))
+
+    def store(self, i, state):
+        """ Write back the position and velocity of a state() copy """
+        self.position[i] = (state.x, state.y)
+        self.velocity[i] = (state.vx, state.vy)
+        self.balls[i].rect.center = (int(state.x), int(self.size[1] - state.y))
+
+    def resolve(self, pairs):
+        """ Resolve the collisions of candidate pairs in conflict-free batches
+
+            Each batch is solved with array operations, exactly as collide()
+            would one pair at a time, as no ball appears twice in it. Pairs
+            sharing a ball are solved in different batches, but not always
+            in their original order.
+
+            With narrowphase "impulse", ImpulseSolver resolves them instead.
+        """
+        if self.narrowphase == "impulse":
+            if self.solver is None:
+                self.solver = ImpulseSolver(self)
+            return self.solver.resolve(pairs)
+        if self.narrowphase != "batch" or self.debug:
+            return super(Physics, self).resolve(pairs)  # Debug prints each pair
+        pairs = list(pairs)
+        if not pairs:
+            return 0
+        I, J = np.array(pairs, dtype=int).T
+        for batch in batches(I, J):
+            self.solve(I[batch], J[batch])
+        touched = np.zeros(len(self.balls), dtype=bool)
+        touched[I] = touched[J] = True
+        self.sync(touched)
+        return len(pairs)
+
+    def solve(self, I, J):
+        """ Resolve the collisions of pairs (I, J), where no ball appears twice """
+        p, v = self.position, self.velocity
+
+        # Drop coincident centers and false positives. Squares are float_power()
+        # as it rounds like Python's ** does, and power() does not
+        dsx, dsy = p[J, 0] - p[I, 0], p[J, 1] - p[I, 1]
+        mag2 = np.float_power(dsx, 2) + np.float_power(dsy, 2)
+        radsum = self.radius[I] + self.radius[J]
+        false = mag2 >= np.float_power(radsum, 2)
+        self.stats.false += int(np.count_nonzero(false))
+        hit = ~false & ((dsx != 0) | (dsy != 0))
+        if not hit.all():
+            I, J, dsx, dsy, mag2, radsum = (_[hit] for _ in (I, J, dsx, dsy, mag2, radsum))
+        if not len(I):
+            return
+
+        dvmag = np.sqrt(mag2)
+        overlap = abs(dvmag - radsum)
+        self.stats.collisions += len(I)
+        self.stats.overlap += float(overlap.sum())
+        self.contacts.append((I, J))
+
+        # A real contact wakes both balls, and whatever pile they rest on
+        rows = np.concatenate((I, J))
+        for k in rows[self.asleep[rows]].tolist():
+            if self.asleep[k]:  # Not woken along with an earlier one
+                self.wake(k)
+
+        before = self.ledger(rows)
+
+        # Same steps as Engine.collide() and restitution(), on arrays of components
+        am, bm = self.mass[I], self.mass[J]
+        CR = np.minimum(self.elasticity[I], self.elasticity[J])
+        invmass = 1. / (am + bm)
+        nx, ny = dsx / dvmag, dsy / dvmag
+
+        d = np.sqrt(np.float_power(nx, 2) + np.float_power(ny, 2))
+        (avx, avy), (bvx, bvy) = v[I].T, v[J].T
+        uanx, uany = project(avx, avy,  nx, ny, d)
+        uatx, uaty = project(avx, avy, -ny, nx, d)
+        ubnx, ubny = project(bvx, bvy,  nx, ny, d)
+        ubtx, ubty = project(bvx, bvy, -ny, nx, d)
+
+        dvnx, dvny = ubnx - uanx, ubny - uany
+        pnx, pny = uanx * am + ubnx * bm, uany * am + ubny * bm
+
+        v[I, 0] = (pnx + dvnx * bm * CR) * invmass + uatx
+        v[I, 1] = (pny + dvny * bm * CR) * invmass + uaty
+        v[J, 0] = (pnx - dvnx * am * CR) * invmass + ubtx
+        v[J, 1] = (pny - dvny * am * CR) * invmass + ubty
+
+        p[I, 0] += -nx * overlap * bm * invmass
+        p[I, 1] += -ny * overlap * bm * invmass
+        p[J, 0] += nx * overlap * am * invmass
+        p[J, 1] += ny * overlap * am * invmass
+
+        self.book(before, self.ledger(rows))
+
+    def recompute(self):
+        self.totals = self.ledger(slice(None))
+
+    @property
+    def on_ground(self):
+        return self.position[:, 1] == self.radius
+
+    def update(self, elapsed=None):
+        if elapsed is None:
+            elapsed = self.timestep
+
+        # dt should be constant and small, 1./60 is perfect. But I shall not enforce this here
+        dt = elapsed
+        v = self.velocity
+        self.previous[:] = self.position
+
+        # Sleeping balls and balls resting on the ground are left untouched
+        resting = (v == 0).all(axis=1) & self.on_ground & ~self.asleep
+        active = ~(self.asleep | resting)
+        self.stats.updated += int(np.count_nonzero(active))
+        self.stats.skipped += int(np.count_nonzero(resting))
+
+        # Balls fast enough to tunnel, and the balls in their way, advance in
+        # substeps, resolving the collisions of the pairs that may meet in
+        # between. Sleeping balls in the way stay put, unless a hit wakes them
+        group, (I, J), substeps = self.sweep(active, dt)
+        if substeps > 1:
+            self.stats.substeps += substeps
+            self.step(active & ~group, dt)
+            for __ in range(substeps):
+                self.step(group & ~self.asleep, dt / substeps)
+                super(Physics, self).resolve(overlapping(self, I, J))
+            active |= group & ~self.asleep
+        else:
+            self.step(active, dt)
+
+        self.sync(active)
+        self.sleep()
+        self.stats.asleep = int(np.count_nonzero(self.asleep))
+
+        self.steps += 1
+        if self.steps % RECOMPUTE == 0:
+            self.recompute()  # Correct the drift of the running totals
+
+    def constants(self):
+        """ Gravity, damping, friction, epsilon_v and lower walls of every ball
+
+            A row per ball, so that step() and sleep() read them alike for a
+            world and for an Ensemble of many. Gravity and damping rows are
+            (x, y) pairs, and lower walls an (x, y) pair of arrays, where
+            ball centers stop.
+        """
+        n = len(self.balls)
+        return (np.broadcast_to(np.asarray(self.gravity, float), (n, 2)),
+                np.broadcast_to(np.asarray(self.damping, float), (n, 2)),
+                np.broadcast_to(float(self.friction), (n,)),
+                np.broadcast_to(float(self.epsilon_v), (n,)),
+                (self.radius, self.radius))
+
+    def step(self, active, dt):
+        """ Move the active balls for dt seconds: gravity, walls and friction """
+        p, v = self.position, self.velocity
+        gravity, damping, friction, epsilon, lower = self.constants()
+        before = self.ledger(active)
+
+        # Apply gravity to velocity, except for balls sliding on the ground,
+        # and velocity to position, each axis by the chosen integrator
+        falling = active & ~(self.on_ground & (v[:, 1] == 0))
+        integrate = INTEGRATORS[self.integrator]
+        for i in [0, 1]:
+            a = np.where(falling[active], gravity[active, i], 0.)
+            p[active, i], v[active, i] = integrate(p[active, i], v[active, i], a, dt)
+
+        # Check wall collisions. Clamping balls back onto the walls changes
+        # their potential energy, which is counted apart
+        y = p[active, 1]
+        for i in [0, 1]:
+            # Boundary checks
+            low  = active & (p[:, i] < lower[i])
+            high = active & (p[:, i] > self.bounds[:, i])
+            p[low,  i] = lower[i][low]
+            p[high, i] = self.bounds[high, i]
+
+            # Save the momentum that will be absorbed by the wall,
+            # then reflect velocity, dampered, and set to zero when low enough
+            hit = low | high
+            self.stats.bounces += int(np.count_nonzero(hit))
+            self.wallp[hit, i] += self.mass[hit] * 2 * v[hit, i]
+            v[hit, i] *= -1 * damping[hit, i]
+            v[hit & (abs(v[:, i]) < epsilon), i] = 0
+
+            # Reset wall momentum if ball stops
+            self.wallp[active & (abs(v[:, i]) < epsilon), i] = 0
+        self.stats.clamp += float(np.dot(self.mass[active] * abs(gravity[active, 1]),
+                                         p[active, 1] - y))
+
+        # Apply friction if ball is sliding on ground
+        sliding = active & self.on_ground & (v[:, 1] == 0)
+        vx = v[sliding, 0]
+        vx -= np.copysign(np.minimum(abs(vx), abs(gravity[sliding, 1] * friction[sliding] * dt)),
+                          vx)
+        vx[abs(vx) < epsilon[sliding]] = 0  # Make it stop if low enough
+        v[sliding, 0] = vx
+
+        self.book(before, self.ledger(active))
+
+    def sweep(self, active, dt):
+        """ Balls to substep, the pairs of them that may meet, and how many substeps
+
+            Active balls are fast when they move more than ccd_fraction of the
+            smallest radius in dt. The group to substep is the fast balls and
+            every ball their swept circles hit within dt, their time of impact
+            in the motion relative to the fast ball. Substeps keep the fast
+            balls under the limit, up to max_substeps.
+
+            Only the pairs within reach, their radii plus what they travel in
+            dt, are tested, as found by nearby().
+        """
+        p, v, r = self.position, self.velocity, self.radius
+        none = np.zeros(0, dtype=int)
+        if not len(r):
+            return None, (none, none), 1
+        limit = self.ccd_fraction * r.min()
+        travel = np.sqrt((v**2).sum(axis=1)) * SCALE * dt
+        fast = active & (travel > limit)
+        if not fast.any():
+            return None, (none, none), 1
+
+        # Swept circles: |d + t*dv| = r[i] + r[j] for t in [0, 1]
+        reach = r + travel
+        I, J = nearby(p, reach, fast)
+        d, dv = p[J] - p[I], (v[J] - v[I]) * SCALE * dt
+        a = (dv**2).sum(axis=1)
+        b = (d * dv).sum(axis=1)
+        c = (d**2).sum(axis=1) - (r[I] + r[J])**2
+        disc = b**2 - a * c
+        toi = -(b + np.sqrt(np.maximum(disc, 0))) / np.maximum(a, EPSILON)
+        hit = (c <= 0) | ((b < 0) & (disc >= 0) & (toi <= 1))
+        group = fast.copy()
+        group[I[hit]] = group[J[hit]] = True
+
+        I, J = nearby(p, reach, group)
+        pairs = group[I] & group[J]
+        return (group, (I[pairs], J[pairs]),
+                min(int(math.ceil(travel[fast].max() / limit)), self.max_substeps))
+
+    @property
+    def awake(self):
+        return ~self.asleep
+
+    @property
+    def resting(self):
+        """ True when no ball would move on the next update """
+        v = self.velocity
+        return bool((self.asleep | ((v == 0).all(axis=1) & self.on_ground)).all())
+
+    def sleep(self):
+        """ Put to sleep the balls that stayed slow for sleep_frames frames
+
+            Balls sleep along with every ball they collided with in the last
+            sleep_frames steps, and transitively, or not at all. Alone, a
+            ball resting on a neighbour still settling would be woken by
+            their next contact, and the pile would never rest.
+        """
+        contacts, self.contacts = self.contacts, []
+        if not self.sleep_frames:
+            return
+
+        # Recent contacts, newest first, keeping the last step of each pair
+        touching = self.touching
+        if contacts:
+            I = np.hstack([i for i, __ in contacts])
+            J = np.hstack([j for __, j in contacts])
+            touching = np.vstack((np.column_stack((I, J, np.full(len(I), self.steps))),
+                                  touching))
+        touching = touching[touching[:, 2] > self.steps - self.sleep_frames]
+        __, last = np.unique(touching[:, 0] << 32 | touching[:, 1], return_index=True)
+        self.touching = touching[last]
+
+        epsilon = self.constants()[3]
+        slow = (self.velocity**2).sum(axis=1) < epsilon**2
+        self.still[~slow] = 0
+        self.still[slow & ~self.asleep] += 1
+        tired = ~self.asleep & (self.still >= self.sleep_frames)
+        if tired.any() and len(self.touching):
+            # Balls still moving keep awake all the balls they are in contact with
+            I, J = self.touching[:, 0], self.touching[:, 1]
+            restless = ~self.asleep & ~tired
+            spread = restless[I] != restless[J]
+            while spread.any():
+                restless[I[spread]] = restless[J[spread]] = True
+                spread = restless[I] != restless[J]
+            tired &= ~restless
+        before = self.ledger(tired)
+        self.asleep[tired] = True
+        self.velocity[tired] = 0
+        self.wallp[tired] = 0
+        self.book(before, self.ledger(tired))
+
+    def wake(self, i):
+        """ Wake ball i and, transitively, all sleeping balls touching it """
+        queue = [i] if self.asleep[i] else []
+        self.asleep[i] = False
+        self.still[i] = 0
+        p, r = self.position, self.radius
+        while queue:
+            k = queue.pop()
+            d2 = ((p - p[k])**2).sum(axis=1)
+            touching = np.flatnonzero(self.asleep & (d2 < (r + r[k] + SLEEP_GAP)**2))
+            self.asleep[touching] = False
+            self.still[touching] = 0
+            queue.extend(touching.tolist())
+
+    def interpolate(self, alpha):
+        """ Move the sprite rects of awake balls between their last two positions
+
+            alpha is the fraction of a step simulated time is ahead of the
+            previous state, 0 for previous and 1 for the current position.
+        """
+        self.sync(self.awake, self.previous + alpha * (self.position - self.previous))
+
+    def sync(self, mask=None, position=None):
+        """ Move the sprite rects of the masked balls to their positions """
+        p = self.position if position is None else position
+        x = p[:, 0].astype(int).tolist()
+        y = (self.size[1] - p[:, 1]).astype(int).tolist()
+        indexes = range(len(self.balls)) if mask is None else np.flatnonzero(mask)
+        for i in indexes:
+            self.balls[i].rect.center = (x[i], y[i])
+
+
+class BallState(object):
+    """ State of one ball as plain floats, cheap to read and update in Python """
+
+    __slots__ = ('x', 'y', 'px', 'py', 'vx', 'vy', 'wx', 'wy', 'bx', 'by',
+                 'radius', 'mass', 'elasticity', 'still', 'asleep')
+
+    def __init__(self, position, velocity, radius, mass, elasticity,
+                 bounds=(0., 0.), asleep=False):
+        self.x, self.y = self.px, self.py = [float(_) for _ in position]
+        self.vx, self.vy = [float(_) for _ in velocity]
+        self.wx = self.wy = 0.
+        self.bx, self.by = bounds
+        self.radius = radius
+        self.mass = mass
+        self.elasticity = elasticity
+        self.still = 0  # Consecutive frames slower than epsilon_v
+        self.asleep = asleep
+
+
+class ScalarPhysics(Engine):
+    """ Ball state as a list of BallState, updated by a plain Python loop
+
+        The fallback engine for when NumPy is not available. Same results as
+        Physics, with no temporaries in the hot path. Sprite rects are synced
+        once per update instead of on every move. Fast balls are not
+        substepped, so balls moving more than their radius in a step may pass
+        through each other.
+
+        With NumPy, the per-ball arrays of the other broad-phases are built
+        on demand.
+    """
+
+    # State array names and their BallState attributes
+    PAIRS = {
+        'position': ('x', 'y'),
+        'previous': ('px', 'py'),
+        'velocity': ('vx', 'vy'),
+        'wallp':    ('wx', 'wy'),
+        'bounds':   ('bx', 'by'),
+    }
+
+    def __init__(self, size, gravity=None, damping=None, friction=None, integrator=None,
+                 timestep=None, **options):
+        self.configure(**options)
+        self.size = tuple(size)
+        self.height = self.size[1]
+        self.gravity  = tuple(GRAVITY if gravity  is None else gravity)
+        self.damping  = tuple(DAMPING if damping  is None else damping)
+        self.friction = FRICTION      if friction is None else friction
+        self.integrator = INTEGRATOR  if integrator is None else integrator
+        self.timestep   = TIMESTEP    if timestep   is None else timestep
+        self.balls = []
+        self.states = []
+        self.stats = Stats()
+        self.steps = 0
+        self.contacts = []  # Pairs (i, j) that collided since sleep()
+        self.touching = {}  # Step of the recent contacts, by (i, j)
+        self.totals = [0., 0., 0., 0.]
+        self.epsilon_v = ((math.hypot(*self.gravity) * self.timestep * SCALE / 2.) or
+                          1./(SCALE * 5))
+
+    def add(self, ball, position, velocity):
+        """ Append a state for ball and return its index """
+        radius = float(ball.radius)
+        self.balls.append(ball)
+        self.states.append(BallState(position, velocity, radius, float(ball.mass),
+                                     float(ball.elasticity),
+                                     (self.size[0] - radius, self.size[1] - radius)))
+        i = len(self.states) - 1
+        self.book((0., 0., 0., 0.), self.entry(i))
+        return i
+
+    def entry(self, i):
+        """ Kinetic energy, potential energy and momentum (x, y) of ball i """
+        s = self.states[i]
+        return (s.mass * (s.vx*s.vx + s.vy*s.vy) / 2.,
+                s.mass * abs(self.gravity[1]) * (s.y - s.radius),
+                s.mass * s.vx + s.wx, s.mass * s.vy + s.wy)
+
+    def book(self, before, after):
+        for k in range(4):
+            self.totals[k] += after[k] - before[k]
+
+    def recompute(self):
+        self.totals = [0., 0., 0., 0.]
+        for i in range(len(self.states)):
+            self.book((0., 0., 0., 0.), self.entry(i))
+
+    def get(self, i, name):
+        s = self.states[i]
+        if name in self.PAIRS:
+            return [getattr(s, _) for _ in self.PAIRS[name]]
+        return getattr(s, name)
+
+    def set(self, i, name, value):
+        """ Set a state pair of ball i, keeping the running totals """
+        before = self.entry(i)
+        s = self.states[i]
+        for attr, v in zip(self.PAIRS[name], value):
+            setattr(s, attr, float(v))
+        self.book(before, self.entry(i))
+
+    def move(self, i, delta):
+        s = self.states[i]
+        before = self.entry(i)
+        s.x += delta[0]
+        s.y += delta[1]
+        self.book(before, self.entry(i))
+
+    def state(self, i):
+        return self.states[i]
+
+    def store(self, i, state):
+        pass  # state() is the ball state itself. Rects are synced on update
+
+    def update(self, elapsed=None):
+        if elapsed is None:
+            elapsed = self.timestep
+
+        # Same steps as Physics.update(), ball by ball
+        dt = elapsed
+        gx, gy = self.gravity[0] * dt, self.gravity[1] * dt
+        friction = abs(self.gravity[1] * self.friction * dt)
+        dampx, dampy = self.damping
+        epsilon = self.epsilon_v
+        g = abs(self.gravity[1])
+        stats = self.stats
+        integrate = None if self.integrator == "euler" else INTEGRATORS[self.integrator]
+        updated = bounces = 0
+        dk = du = dpx = dpy = clamp = 0.
+        for s in self.states:
+            s.px, s.py = s.x, s.y
+            if s.asleep:
+                continue
+
+            # Balls resting on the ground are left untouched
+            ground = s.y == s.radius
+            if ground and s.vx == 0 and s.vy == 0:
+                stats.skipped += 1
+                continue
+            updated += 1
+            m = s.mass
+            dk -= m * (s.vx*s.vx + s.vy*s.vy) / 2.
+            du -= m * g * (s.y - s.radius)
+            dpx -= m * s.vx + s.wx
+            dpy -= m * s.vy + s.wy
+
+            # Apply gravity to velocity, except when sliding on the ground,
+            # then velocity to position, semi-implicit Euler method
+            if integrate is None:
+                if not (ground and s.vy == 0):
+                    s.vx += gx
+                    s.vy += gy
+                s.x += s.vx * SCALE * dt
+                s.y += s.vy * SCALE * dt
+            else:
+                falling = not (ground and s.vy == 0)
+                s.x, s.vx = integrate(s.x, s.vx, self.gravity[0] if falling else 0., dt)
+                s.y, s.vy = integrate(s.y, s.vy, self.gravity[1] if falling else 0., dt)
+
+            # Check wall collisions, saving the momentum absorbed by the wall,
+            # then reflect velocity, dampered, and set to zero when low enough
+            hit = True
+            if   s.x < s.radius: s.x = s.radius
+            elif s.x > s.bx:     s.x = s.bx
+            else:                hit = False
+            if hit:
+                bounces += 1
+                s.wx += m * 2 * s.vx
+                s.vx *= -1 * dampx
+                if abs(s.vx) < epsilon: s.vx = 0.
+            if abs(s.vx) < epsilon: s.wx = 0.  # Reset wall momentum if ball stops
+
+            hit = True
+            y = s.y
+            if   s.y < s.radius: s.y = s.radius
+            elif s.y > s.by:     s.y = s.by
+            else:                hit = False
+            if hit:
+                clamp += m * g * (s.y - y)
+                bounces += 1
+                s.wy += m * 2 * s.vy
+                s.vy *= -1 * dampy
+                if abs(s.vy) < epsilon: s.vy = 0.
+            if abs(s.vy) < epsilon: s.wy = 0.
+
+            # Apply friction if ball is sliding on ground
+            if s.y == s.radius and s.vy == 0:
+                s.vx -= math.copysign(min(abs(s.vx), friction), s.vx)
+                if abs(s.vx) < epsilon: s.vx = 0.  # Make it stop if low enough
+
+            dk += m * (s.vx*s.vx + s.vy*s.vy) / 2.
+            du += m * g * (s.y - s.radius)
+            dpx += m * s.vx + s.wx
+            dpy += m * s.vy + s.wy
+
+        stats.updated += updated
+        stats.bounces += bounces
+        stats.clamp += clamp
+        self.book((0., 0., 0., 0.), (dk, du, dpx, dpy))
+        self.sync()
+        self.sleep()
+        stats.asleep = sum(1 for s in self.states if s.asleep)
+
+        self.steps += 1
+        if self.steps % RECOMPUTE == 0:
+            self.recompute()  # Correct the drift of the running totals
+
+    @property
+    def resting(self):
+        """ True when no ball would move on the next update """
+        return all(s.asleep or (s.vx == 0 and s.vy == 0 and s.y == s.radius)
+                   for s in self.states)
+
+    def sleep(self):
+        """ Put to sleep the balls that stayed slow for sleep_frames frames,
+            along with their recent contacts, as Physics.sleep() does
+        """
+        contacts, self.contacts = self.contacts, []
+        if not self.sleep_frames:
+            return
+        oldest = self.steps - self.sleep_frames
+        self.touching = dict((pair, step) for pair, step in self.touching.items()
+                             if step > oldest)
+        self.touching.update((pair, self.steps) for pair in contacts)
+
+        epsilon2 = self.epsilon_v**2
+        restless = []
+        for s in self.states:
+            if s.vx**2 + s.vy**2 >= epsilon2:
+                s.still = 0
+            elif not s.asleep:
+                s.still += 1
+            restless.append(not s.asleep and s.still < self.sleep_frames)
+        if all(restless):
+            return
+
+        # Balls still moving keep awake all the balls they are in contact with
+        spread = True
+        while spread:
+            spread = False
+            for i, j in self.touching:
+                if restless[i] != restless[j]:
+                    restless[i] = restless[j] = spread = True
+
+        for i, s in enumerate(self.states):
+            if not s.asleep and not restless[i]:
+                before = self.entry(i)
+                s.asleep = True
+                s.vx = s.vy = s.wx = s.wy = 0.
+                self.book(before, self.entry(i))
+
+    def wake(self, i):
+        """ Wake ball i and, transitively, all sleeping balls touching it """
+        states = self.states
+        queue = [states[i]] if states[i].asleep else []
+        states[i].asleep = False
+        states[i].still = 0
+        while queue:
+            k = queue.pop()
+            for s in states:
+                if s.asleep and ((s.x - k.x)**2 + (s.y - k.y)**2 <
+                                 (s.radius + k.radius + SLEEP_GAP)**2):
+                    s.asleep = False
+                    s.still = 0
+                    queue.append(s)
+
+    def interpolate(self, alpha):
+        """ Move the sprite rects of awake balls between their last two positions """
+        for ball, s in zip(self.balls, self.states):
+            if not s.asleep:
+                ball.rect.center = (int(s.px + alpha * (s.x - s.px)),
+                                    int(self.height - (s.py + alpha * (s.y - s.py))))
+
+    def sync(self):
+        """ Move the sprite rects of awake balls to their positions """
+        for ball, s in zip(self.balls, self.states):
+            if not s.asleep:
+                ball.rect.center = (int(s.x), int(self.height - s.y))
+
+    # Per-ball arrays, as Physics has them, for the NumPy broad-phases and rendering
+    @property
+    def position(self):
+        return np.array([(s.x, s.y) for s in self.states]).reshape(-1, 2)
+
+    @property
+    def velocity(self):
+        return np.array([(s.vx, s.vy) for s in self.states]).reshape(-1, 2)
+
+    @property
+    def radius(self):
+        return np.array([s.radius for s in self.states])
+
+    @property
+    def mass(self):
+        return np.array([s.mass for s in self.states])
+
+    @property
+    def asleep(self):
+        return np.array([s.asleep for s in self.states], dtype=bool)
+
+    @property
+    def awake(self):
+        return ~self.asleep
+
+
+class EventPhysics(ScalarPhysics):
+    """ Event-driven engine for hard-disk gases, where balls fly straight
+
+        Instead of fixed steps and overlap correction, it predicts the exact
+        times of ball and wall collisions and jumps from one to the next, in
+        a priority queue. When a ball collides, its other predictions go
+        stale. They are left in the queue and skipped when popped, as the
+        collision count of the ball changed since.
+
+        update() resolves the events up to the end of the step, and rendering
+        samples the state at that time. Balls are only moved along their
+        flights when an event or a state access involves them. Ball
+        collisions use restitution() with no overlap correction, as balls
+        meet exactly touching. Gravity must be zero, and nothing ever sleeps,
+        which would hide balls from the predictions.
+
+        Overlapping balls, as random placement leaves them, do not collide
+        until they come apart. Colliding them at once never ends in clusters,
+        where each bounce sends a ball back into another it overlaps.
+
+        Predictions are vectorized over the flights of all balls, and only
+        queued when earlier than the next wall hit of either ball, as that
+        would make them stale anyway.
+    """
+
+    events = True
+
+    def __init__(self, size, gravity=None, damping=None, friction=None, integrator=None,
+                 timestep=None, **options):
+        gravity = (0, 0) if gravity is None else tuple(gravity)
+        if any(gravity):
+            raise ValueError("Event-driven physics requires zero gravity, not %r" % (gravity,))
+        super(EventPhysics, self).__init__(size, gravity, damping, friction, integrator,
+                                           timestep, **options)
+        self.time = 0.     # Simulated time, in seconds
+        self.times = []    # Time at which each ball state is current
+        self.counts = []   # Collisions of each ball, to spot stale events
+        self.queue = None  # Heap of (time, i, j, count i, count j). j < 0 for walls
+
+        # Flight of each ball: position, velocity and start time. And when
+        # it ends at a wall
+        self.flight = np.zeros((0, 5))
+        self.walltime = np.zeros(0)
+        self.radii = np.zeros(0)
+        self.previous = np.zeros((0, 2))  # Positions before the last update
+
+    def add(self, ball, position, velocity):
+        self.times.append(self.time)
+        self.counts.append(0)
+        self.flight = np.vstack((self.flight, np.zeros(5)))
+        self.walltime = np.append(self.walltime, np.inf)
+        self.radii = np.append(self.radii, ball.radius)
+        self.queue = None  # Predict again on the next update
+        i = super(EventPhysics, self).add(ball, position, velocity)
+        self.fly(i)
+        return i
+
+    def advance(self, i):
+        """ Move ball i to the current time """
+        s, dt = self.states[i], self.time - self.times[i]
+        if dt:
+            s.x += s.vx * SCALE * dt
+            s.y += s.vy * SCALE * dt
+            self.times[i] = self.time
+
+    def get(self, i, name):
+        self.advance(i)
+        return super(EventPhysics, self).get(i, name)
+
+    def set(self, i, name, value):
+        self.advance(i)
+        super(EventPhysics, self).set(i, name, value)
+        self.invalidate(i)
+
+    def move(self, i, delta):
+        self.advance(i)
+        super(EventPhysics, self).move(i, delta)
+        self.invalidate(i)
+
+    def invalidate(self, i):
+        """ Drop the predictions of ball i and predict it again """
+        self.counts[i] += 1
+        if self.queue is None:
+            self.fly(i)
+        else:
+            self.predict(i)
+
+    def predict(self, i):
+        """ Start a new flight of ball i at the current time, and queue its collisions """
+        self.launch(i)
+        self.approach(i)
+
+    def launch(self, i):
+        """ Start a new flight of ball i at the current time, queueing its next wall hit """
+        s, now = self.states[i], self.time
+        walls = []
+        for axis, x, v, high in ((0, s.x, s.vx, s.bx), (1, s.y, s.vy, s.by)):
+            if v:
+                t = ((high if v > 0 else s.radius) - x) / (v * SCALE)
+                walls.append((now + max(t, 0.), i, -1 - axis, self.counts[i], 0))
+        wall = min(walls) if walls else (np.inf,)
+        if walls:
+            heapq.heappush(self.queue, wall)
+        self.walltime[i] = wall[0]
+        self.fly(i)
+
+    def fly(self, i):
+        """ Set the flight of ball i from its current state """
+        s = self.states[i]
+        self.flight[i] = (s.x, s.y, s.vx, s.vy, self.times[i])
+
+    def approach(self, i):
+        """ Queue the collisions of ball i with other balls, before the wall hits """
+        s, now = self.states[i], self.time
+
+        # Relative positions now, and relative velocities in pixels per second
+        f = self.flight
+        dt = now - f[:, 4]
+        dx = f[:, 0] + f[:, 2] * SCALE * dt - s.x
+        dy = f[:, 1] + f[:, 3] * SCALE * dt - s.y
+        dvx, dvy = (f[:, 2] - s.vx) * SCALE, (f[:, 3] - s.vy) * SCALE
+        b = dx * dvx + dy * dvy
+        radsum = self.radii + s.radius
+        c = dx**2 + dy**2 - radsum**2
+        d = b**2 - (dvx**2 + dvy**2) * c
+
+        # Approaching, and not passing by. Touching, up to rounding, collide
+        # now, but overlapping pass through each other
+        hit = (b < 0) & (d >= 0) & (c >= -EPSILON * radsum**2)
+        hit[i] = False
+        K = np.flatnonzero(hit)
+        T = now + np.maximum(c[K] / (np.sqrt(d[K]) - b[K]), 0.)
+        soon = T < np.minimum(self.walltime[K], self.walltime[i])
+        for k, t in zip(K[soon].tolist(), T[soon].tolist()):
+            heapq.heappush(self.queue, (t, i, k, self.counts[i], self.counts[k]))
+
+    def wall(self, i, axis):
+        """ Reflect ball i off a wall, dampered, saving the momentum it absorbs """
+        s = self.states[i]
+        before = self.entry(i)
+        epsilon = self.epsilon_v
+        if axis == 0:
+            s.x = s.bx if s.vx > 0 else s.radius
+            s.wx += s.mass * 2 * s.vx
+            s.vx *= -1 * self.damping[0]
+            if abs(s.vx) < epsilon: s.vx = s.wx = 0.
+        else:
+            s.y = s.by if s.vy > 0 else s.radius
+            s.wy += s.mass * 2 * s.vy
+            s.vy *= -1 * self.damping[1]
+            if abs(s.vy) < epsilon: s.vy = s.wy = 0.
+        self.book(before, self.entry(i))
+        self.stats.bounces += 1
+
+    def bounce(self, i, j):
+        """ Collide touching balls i and j """
+        a, b = self.states[i], self.states[j]
+        dsx, dsy = b.x - a.x, b.y - a.y
+        dist = math.sqrt(dsx ** 2 + dsy ** 2)
+        if not dist:
+            return
+        before = self.entry(i), self.entry(j)
+        restitution(a, b, dsx / dist, dsy / dist)
+        self.book(before[0], self.entry(i))
+        self.book(before[1], self.entry(j))
+        self.stats.collisions += 1
+        self.stats.overlap += max(a.radius + b.radius - dist, 0)
+
+    def update(self, elapsed=None):
+        if elapsed is None:
+            elapsed = self.timestep
+
+        if self.queue is None:
+            self.queue = []
+            for i in range(len(self.states)):
+                self.launch(i)
+            for i in range(len(self.states)):
+                self.approach(i)
+        self.previous = self.position
+
+        end = self.time + elapsed
+        queue, counts = self.queue, self.counts
+        while queue and queue[0][0] <= end:
+            t, i, j, ci, cj = heapq.heappop(queue)
+            if counts[i] != ci or (j >= 0 and counts[j] != cj):
+                continue  # Stale
+            self.time = max(t, self.time)
+            self.advance(i)
+            if j < 0:
+                self.wall(i, -1 - j)
+                counts[i] += 1
+                self.predict(i)
+            else:
+                self.advance(j)
+                self.bounce(i, j)
+                counts[i] += 1
+                counts[j] += 1
+                self.launch(i)
+                self.launch(j)
+                self.approach(i)
+                self.approach(j)
+
+        self.time = end
+        self.stats.updated += len(self.states)
+        self.sync()
+
+        self.steps += 1
+        if self.steps % RECOMPUTE == 0:
+            self.recompute()  # Correct the drift of the running totals
+
+    def resolve(self, pairs):
+        return 0  # Collisions were resolved at their exact time by update()
+
+    @property
+    def position(self):
+        """ Positions at the current time, along the flights """
+        f = self.flight
+        return f[:, :2] + f[:, 2:4] * SCALE * (self.time - f[:, 4])[:, None]
+
+    def interpolate(self, alpha):
+        self.place(self.previous + alpha * (self.position - self.previous))
+
+    def sync(self):
+        self.place(self.position)
+
+    def place(self, position):
+        """ Move the sprite rects to position """
+        x = position[:, 0].astype(int).tolist()
+        y = (self.height - position[:, 1]).astype(int).tolist()
+        for ball, cx, cy in zip(self.balls, x, y):
+            ball.rect.center = (cx, cy)
+
+    def sleep(self):
         pass
 
+    @property
+    def resting(self):
+        return all(s.vx == 0 and s.vy == 0 for s in self.states)
+
+
+class Ensemble(Physics):
+    """ Many numpy engines stacked in one set of arrays, as worlds of one Physics
+
+        Each row has the index of its world, and gravity, damping, friction
+        and epsilon_v are per world, so update, walls and collisions of all
+        worlds run in the same vectorized passes. Worlds are laid side by
+        side along x, world k from origin[k], a ball diameter plus skin
+        apart, so broad-phases hardly see pairs across worlds, and resolve()
+        drops any that show up. Fast balls are substepped as finely as the
+        fastest of any world needs, so results match the worlds stepped
+        alone only up to that, and to the rounding of the offsets.
+
+        Running totals are kept per world, so energy and momentum are arrays
+        with a row per world. The balls of the engines move over to the
+        ensemble, leaving the engines unusable. Sprite rects are not synced,
+        so neither rendering nor the sprite broad-phase work on ensembles.
+        Tuning options, as Engine.configure() sets them, are the first
+        engine's.
+    """
+
+    FIELDS = Physics.FIELDS + (('world', (), int),)
+
+    def __init__(self, engines):
+        engines = list(engines)
+        if not engines or any(type(_) is not Physics for _ in engines):
+            raise ValueError("Ensembles stack numpy engines, not %r" % (engines,))
+        first = engines[0]
+        if any((_.timestep, _.integrator) != (first.timestep, first.integrator)
+               for _ in engines):
+            raise ValueError("Ensemble engines must share timestep and integrator")
+        options = dict((name, getattr(first, name)) for name in (
+            'narrowphase', 'sleep_frames', 'skin', 'ccd_fraction', 'max_substeps',
+            'iterations', 'slop', 'debug'))
+
+        widths = [_.size[0] for _ in engines]
+        gap = 2 * max([_.radius.max() for _ in engines if len(_)] or [0]) + first.skin
+        self.origin = np.concatenate(([0.], np.cumsum(np.add(widths, gap))[:-1]))
+        size = (self.origin[-1] + widths[-1], max(_.size[1] for _ in engines))
+        super(Ensemble, self).__init__(size, integrator=first.integrator,
+                                       timestep=first.timestep,
+                                       capacity=max(sum(len(_) for _ in engines), 1),
+                                       **options)
+        self.gravity  = np.array([_.gravity  for _ in engines], dtype=float)
+        self.damping  = np.array([_.damping  for _ in engines], dtype=float)
+        self.friction = np.array([_.friction for _ in engines], dtype=float)
+        self.epsilons = np.array([_.epsilon_v for _ in engines])
+        self.epsilon_v = self.epsilons.min()  # For the ImpulseSolver thresholds
+
+        start = 0
+        for k, engine in enumerate(engines):
+            rows = slice(start, start + len(engine))
+            for name, __, __ in Physics.FIELDS:
+                getattr(self, '_' + name)[rows] = getattr(engine, name)
+            for name in ('position', 'previous', 'bounds'):
+                getattr(self, '_' + name)[rows, 0] += self.origin[k]
+            self._world[rows] = k
+            for ball in engine.balls:
+                ball.physics = self
+                ball.index += start
+            self.balls.extend(engine.balls)
+            start += len(engine)
+        self._views()
+        self.recompute()
+
+    def entry(self, i):
+        """ Per-world totals holding only the entry of ball i """
+        k = int(self.world[i])
+        m, r = float(self.mass[i]), float(self.radius[i])
+        (__, y), (vx, vy), (wx, wy) = (self.position[i].tolist(), self.velocity[i].tolist(),
+                                       self.wallp[i].tolist())
+        totals = np.zeros((len(self.origin), 4))
+        totals[k] = (m * (vx*vx + vy*vy) / 2., m * abs(float(self.gravity[k, 1])) * (y - r),
+                     m * vx + wx, m * vy + wy)
+        return totals
+
+    def ledger(self, rows):
+        """ Sums of entry() over rows, a mask or an index array, by world """
+        w, m, v = self.world[rows], self.mass[rows], self.velocity[rows]
+        columns = (m * (v**2).sum(axis=1) / 2.,
+                   abs(self.gravity[w, 1]) * m * (self.position[rows, 1] - self.radius[rows]),
+                   m * v[:, 0] + self.wallp[rows, 0],
+                   m * v[:, 1] + self.wallp[rows, 1])
+        return np.column_stack([np.bincount(w, c, len(self.origin)) for c in columns])
+
+    def gravity_of(self, i):
+        return tuple(self.gravity[self.world[i]].tolist())
 
-class Args(object):
-    def __init__(self, **kwargs):
-        for arg in kwargs:
-            setattr(self, arg, kwargs[arg])
+    @property
+    def energy(self):
+        return self.totals[:, 0] + self.totals[:, 1]
 
+    @property
+    def momentum(self):
+        return self.totals[:, 2:]
 
+    def energy_momentum(self):
+        """ Energy and momentum of each world, zeroed under EPSILON as main() shows them """
+        E, P = self.energy.copy(), self.momentum.copy()
+        E[abs(E) < EPSILON] = 0
+        P[abs(P) < EPSILON] = 0
+        return E, P
+
+    @property
+    def settled(self):
+        """ Whether each world is resting """
+        v = self.velocity
+        moving = ~(self.asleep | ((v == 0).all(axis=1) & self.on_ground))
+        return np.bincount(self.world, moving, len(self.origin)) == 0
+
+    def resolve(self, pairs):
+        """ Resolve candidate pairs as Physics does, dropping any across worlds """
+        pairs = np.array(list(pairs), dtype=int).reshape(-1, 2)
+        pairs = pairs[self.world[pairs[:, 0]] == self.world[pairs[:, 1]]]
+        return super(Ensemble, self).resolve(pairs.tolist())
+
+    def constants(self):
+        """ Physics.constants(), of each ball's world, and its left wall """
+        w = self.world
+        return (self.gravity[w], self.damping[w], self.friction[w], self.epsilons[w],
+                (self.origin[w] + self.radius, self.radius))
+
+    def sync(self, mask=None, position=None):
+        pass  # Ensembles are not drawn
+
+
+class ImpulseSolver(object):
+    """ Iterative contact solver for the numpy engine, with warm starting
+
+        Contacts get normal impulses, accumulated and clamped to push only,
+        for up to iterations passes over conflict-free batches, or until no
+        velocity changes by more than 1% of epsilon_v. Restitution applies
+        only to approach speeds above epsilon_v, so resting contacts settle.
+        The impulses of each contact are cached by ball pair, and applied
+        upfront on the next step, so steady piles need few iterations.
+
+        Overlap beyond slop is then corrected by moving the balls apart,
+        inversely to their masses. Leaving slop keeps resting contacts
+        touching, and their cached impulses alive.
+
+        Sleeping balls are immovable, unless hit faster than epsilon_v or
+        pushed in beyond twice the slop, which wakes them.
+    """
+
+    def __init__(self, physics, iterations=None, slop=None):
+        self.physics = physics
+        self.iterations = physics.iterations if iterations is None else iterations
+        self.slop = physics.slop if slop is None else slop
+        self.impulses = {}  # Accumulated normal impulse of the last step, by (i, j)
+
+    def resolve(self, pairs):
+        """ Solve the contacts among candidate pairs. Return how many pairs there were """
+        physics, stats = self.physics, self.physics.stats
+        pairs = list(pairs)
+        I, J = np.array(pairs, dtype=int).reshape(-1, 2).T
+        p, v, r = physics.position, physics.velocity, physics.radius
+
+        # Contacts are the actually overlapping pairs
+        ds = p[J] - p[I]
+        dist2 = (ds**2).sum(axis=1)
+        false = dist2 >= (r[I] + r[J])**2
+        stats.false += int(np.count_nonzero(false))
+        contact = ~false & (dist2 > 0)
+        I, J, ds, dist = I[contact], J[contact], ds[contact], np.sqrt(dist2[contact])
+        n = ds / dist[:, None]
+        overlap = r[I] + r[J] - dist
+        vn = ((v[J] - v[I]) * n).sum(axis=1)  # Relative normal velocity, < 0 approaching
+
+        # Wake the sleeping balls that take a real hit
+        eps = physics.epsilon_v
+        hit = (vn < -eps) | (overlap > 2 * self.slop)
+        for k in np.concatenate((I[hit], J[hit])).tolist():
+            if physics.asleep[k]:
+                physics.wake(k)
+        invmass = np.where(physics.asleep, 0, 1. / physics.mass)
+        ima, imb = invmass[I], invmass[J]
+        keep = (ima + imb) > 0
+        I, J, n, vn, ima, imb = (_[keep] for _ in (I, J, n, vn, ima, imb))
+        stats.collisions += len(I)
+        stats.overlap += float(np.maximum(overlap[keep] - self.slop, 0).sum())
+        physics.contacts.append((I, J))
+        if not len(I):
+            self.impulses = {}
+            return len(pairs)
+
+        rows = np.unique(np.concatenate((I, J)))
+        before = physics.ledger(rows)
+        keys = list(zip(I.tolist(), J.tolist()))
+        k = 1. / (ima + imb)  # Effective mass along the normal
+        CR = np.minimum(physics.elasticity[I], physics.elasticity[J])
+        target = np.where(vn < -eps, -CR * vn, 0)  # Normal velocity after the contact
+
+        # Warm start with the impulses of the last step
+        impulse = np.array([self.impulses.get(key, 0.) for key in keys])
+        np.subtract.at(v, I, n * (impulse * ima)[:, None])
+        np.add.at(v, J, n * (impulse * imb)[:, None])
+
+        groups = batches(I, J)
+        for iteration in range(self.iterations):
+            stats.iterations += 1
+            change = 0
+            for b in groups:
+                i, j, nb = I[b], J[b], n[b]
+                vn = ((v[j] - v[i]) * nb).sum(axis=1)
+                total = np.maximum(impulse[b] + k[b] * (target[b] - vn), 0)
+                delta = total - impulse[b]
+                impulse[b] = total
+                v[i] -= nb * (delta * ima[b])[:, None]
+                v[j] += nb * (delta * imb[b])[:, None]
+                change = max(change, float(abs(delta / k[b]).max()))
+            if change < eps / 100.:
+                break
+        self.impulses = dict(zip(keys, impulse.tolist()))
+
+        # Position correction, with the overlaps as left by earlier batches
+        for b in groups:
+            i, j = I[b], J[b]
+            ds = p[j] - p[i]
+            dist = np.sqrt((ds**2).sum(axis=1))
+            correction = np.maximum(r[i] + r[j] - dist - self.slop, 0) / (ima[b] + imb[b])
+            push = ds / np.maximum(dist, EPSILON)[:, None] * correction[:, None]
+            p[i] -= push * ima[b][:, None]
+            p[j] += push * imb[b][:, None]
+
+        physics.book(before, physics.ledger(rows))
+        touched = np.zeros(len(physics), dtype=bool)
+        touched[rows] = True
+        physics.sync(touched)
+        return len(pairs)
+
+
+ENGINES = {
+    "numpy":  Physics,
+    "python": ScalarPhysics,
+    "event":  EventPhysics,
+}
+
+
+def overlapping(physics, I, J, margin=0):
+    """ Filter candidate index pairs (I, J) down to a list of (i, j) tuples
+
+        Keeps the pairs of circles closer than the sum of radii plus margin,
+        except the ones where both balls are asleep.
+    """
+    p, r = physics.position, physics.radius
+    d2 = ((p[J] - p[I])**2).sum(axis=1)
+    hit = (d2 < (r[I] + r[J] + margin)**2) & ~(physics.asleep[I] & physics.asleep[J])
+    return list(zip(I[hit].tolist(), J[hit].tolist()))
+
+
+def nearby(position, reach, query):
+    """ Index arrays (I, J), sorted pairs with I < J, of the circles of radii
+        reach that overlap, where at least one is a query ball
+
+        A uniform grid of cells the size of the mean diameter, built with
+        array operations. Every circle goes in each cell its bounding box
+        touches, and query circles pair with the other circles of their cells.
+    """
+    none = np.zeros(0, dtype=int)
+    if not query.any():
+        return none, none
+    size = max(2 * float(reach.mean()), 1.)
+    low = ((position - reach[:, None]) // size).astype(int)
+    span = ((position + reach[:, None]) // size).astype(int) - low + 1
+    count = span[:, 0] * span[:, 1]
+
+    # One entry per circle and cell, sorted by cell
+    ball = np.repeat(np.arange(len(reach)), count)
+    k = np.arange(len(ball)) - np.repeat(np.cumsum(count) - count, count)
+    cx = low[ball, 0] + k % span[ball, 0]
+    cy = low[ball, 1] + k // span[ball, 0]
+    order = np.lexsort((ball, cy, cx))
+    ball, cx, cy = ball[order], cx[order], cy[order]
+    first = np.flatnonzero(np.r_[True, (cx[1:] != cx[:-1]) | (cy[1:] != cy[:-1])])
+    cell = np.repeat(np.arange(len(first)), np.diff(np.r_[first, len(ball)]))
+
+    # Each query entry with every entry of its cell
+    Q = np.flatnonzero(query[ball])
+    start = first[cell[Q]]
+    members = np.r_[first[1:], len(ball)][cell[Q]] - start
+    offset = np.arange(members.sum()) - np.repeat(np.cumsum(members) - members, members)
+    A = np.repeat(ball[Q], members)
+    B = ball[np.repeat(start, members) + offset]
+    keys = np.unique(np.minimum(A, B)[A != B] << 32 | np.maximum(A, B)[A != B])
+    I, J = keys >> 32, keys & 0xffffffff
+    hit = ((position[J] - position[I])**2).sum(axis=1) < (reach[I] + reach[J])**2
+    return I[hit], J[hit]
+
+
+class SpatialHash(object):
+    """ Uniform grid broad-phase over a Physics ball set
+
+        Each ball is registered in every cell its bounding box touches, and
+        only balls sharing a cell become candidate pairs. Cell ranges are
+        kept per ball, so after balls move only the ones that crossed a cell
+        border are re-hashed. Candidates are then filtered by the actual
+        circle distance, so no pair with separated circles is ever emitted.
+    """
+
+    def __init__(self, physics, cellsize=None, margin=0):
+        self.physics = physics
+        self.margin = margin  # Added to every radius, for neighbourhood queries
+        self.fixedsize = cellsize
+        self.cellsize = cellsize
+        self.cells = {}
+        self.ranges = np.zeros((0, 4), dtype=int)
+
+    def rebuild(self):
+        """ Choose the cell size and hash all balls from scratch """
+        radius = self.physics.radius
+        if self.fixedsize:
+            self.cellsize = self.fixedsize
+        else:
+            # Mean diameter: small balls share few cells, big ones span a handful
+            self.cellsize = max(1, int(2 * radius.mean())) if len(radius) else 1
+        self.cells = {}
+        self.ranges = np.zeros((len(radius), 4), dtype=int)
+        for i, cells in enumerate(self._ranges()):
+            self._insert(i, cells)
+
+    def _ranges(self):
+        # Cell index range (x0, y0, x1, y1) of each ball bounding box
+        p, r = self.physics.position, self.physics.radius[:, None] + self.margin
+        return np.hstack(((p - r) // self.cellsize,
+                          (p + r) // self.cellsize)).astype(int)
+
+    def _cells(self, ranges):
+        x0, y0, x1, y1 = ranges
+        return ((x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1))
+
+    def _insert(self, i, ranges):
+        self.ranges[i] = ranges
+        for cell in self._cells(ranges.tolist()):
+            self.cells.setdefault(cell, set()).add(i)
+
+    def _remove(self, i):
+        for cell in self._cells(self.ranges[i].tolist()):
+            members = self.cells[cell]
+            members.discard(i)
+            if not members:
+                del self.cells[cell]
+
+    def update(self):
+        """ Re-hash only the balls whose cell range changed """
+        if len(self.ranges) != len(self.physics):
+            self.rebuild()
+            return
+        ranges = self._ranges()
+        for i in np.flatnonzero((ranges != self.ranges).any(axis=1)):
+            self._remove(i)
+            self._insert(i, ranges[i])
+
+    def candidates(self):
+        """ Index arrays (I, J), I < J, of the balls sharing at least one cell
+
+            Only cells holding an awake ball are visited, so pairs of
+            sleeping balls cost nothing.
+        """
+        asleep = self.physics.asleep
+        pairs = set()
+        if not asleep.any():
+            for members in self.cells.values():
+                if len(members) > 1:
+                    members = sorted(members)
+                    for k, a in enumerate(members[:-1]):
+                        pairs.update((a, b) for b in members[k+1:])
+        else:
+            for i in np.flatnonzero(~asleep).tolist():
+                for cell in self._cells(self.ranges[i].tolist()):
+                    pairs.update((i, j) if i < j else (j, i)
+                                 for j in self.cells[cell] if j != i)
+        if not pairs:
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+        pairs = np.array(sorted(pairs))
+        return pairs[:, 0], pairs[:, 1]
+
+    def pairs(self):
+        """ Sorted list of (i, j) index pairs of overlapping circles """
+        self.update()
+        I, J = self.candidates()
+        return overlapping(self.physics, I, J, 2 * self.margin)
+
+
+class SpriteCollide(object):
+    """ The original broad-phase: rect test of every ball against all the next ones
+
+        Quadratic, and rect overlap lets some separated circles through to
+        Ball.collide. Kept as a reference for the other broad-phases.
+
+        Tests run against the rects as they are when each pair is drawn.
+        Only the numpy engine resolving pair by pair, with narrowphase
+        "pair" or debug, moves rects between pairs, and matches the original
+        program exactly. The batch and impulse narrow-phases draw all pairs
+        upfront, and the python engine only syncs rects once per update, so
+        later tests miss the moves of earlier collisions. The python engine,
+        all there is without NumPy, diverges from the original this way.
+    """
+
+    def __init__(self, physics):
+        self.physics = physics
+
+    def pairs(self):
+        # Lazy, so pair by pair resolution sees the rects moved by earlier pairs
+        balllist = self.physics.balls
+        asleep = [ball.asleep for ball in balllist]
+        for i, ball in enumerate(balllist[:-1]):
+            others = balllist[i+1:]
+            if asleep[i]:
+                others = [other for other in others if not asleep[other.index]]
+            for other in pygame.sprite.spritecollide(ball, others, False):
+                yield i, other.index
+
+
+class SweepAndPrune(object):
+    """ Sweep-and-prune broad-phase on the x axis, persistent across frames
+
+        Ball interval endpoints are kept in a sorted list that is re-sorted
+        with insertion sort every step, which is nearly linear as balls move
+        little per step. Every swap of a start and an end endpoint adds or
+        removes a pair in the set of x-overlapping pairs, so the set is
+        maintained incrementally instead of rebuilt.
+    """
+
+    def __init__(self, physics):
+        self.physics = physics
+        self.order = []       # Endpoint ids sorted by value: 2*i is start, 2*i+1 is end of ball i
+        self.overlaps = set()  # (i, j), i < j, of balls whose x intervals overlap
+
+    def _values(self):
+        x, r = self.physics.position[:, 0], self.physics.radius
+        values = np.empty(2 * len(x))
+        values[0::2] = x - r
+        values[1::2] = x + r
+        return values.tolist()
+
+    def rebuild(self):
+        """ Sort all endpoints and sweep once to find the overlapping pairs """
+        values = self._values()
+        self.order = sorted(range(len(values)), key=lambda e: (values[e], e & 1))
+        self.overlaps = set()
+        open_ = set()
+        for e in self.order:
+            i = e >> 1
+            if e & 1:
+                open_.discard(i)
+            else:
+                self.overlaps.update((min(i, j), max(i, j)) for j in open_)
+                open_.add(i)
+
+    def update(self):
+        """ Insertion sort the endpoints, tracking overlaps on every swap """
+        if len(self.order) != 2 * len(self.physics):
+            self.rebuild()
+            return
+        values = self._values()
+        order, overlaps = self.order, self.overlaps
+        for k in range(1, len(order)):
+            e = order[k]
+            v = values[e]
+            j = k - 1
+            while j >= 0 and values[order[j]] > v:
+                f = order[j]
+                # e moves left past f
+                if e & 1 != f & 1:
+                    a, b = e >> 1, f >> 1
+                    pair = (a, b) if a < b else (b, a)
+                    if e & 1:
+                        overlaps.discard(pair)  # end passed a start: intervals split
+                    else:
+                        overlaps.add(pair)      # start passed an end: intervals meet
+                order[j + 1] = f
+                j -= 1
+            order[j + 1] = e
+
+    def pairs(self):
+        """ Sorted list of (i, j) index pairs of overlapping circles """
+        self.update()
+        if not self.overlaps:
+            return []
+        pairs = np.array(sorted(self.overlaps))
+        I, J = pairs[:, 0], pairs[:, 1]
+        return overlapping(self.physics, I, J)
+
+
+class NeighbourList(object):
+    """ Verlet neighbour lists: pairs closer than the sum of radii plus a skin
+
+        The list is built with a spatial hash and reused across frames. No
+        pair outside it can touch until some ball has moved more than half
+        the skin since the build, and only then the list is rebuilt. The
+        pairs in the list are filtered by circle distance every frame.
+    """
+
+    def __init__(self, physics, skin=None):
+        self.physics = physics
+        self.skin = physics.skin if skin is None else skin
+        self.grid = SpatialHash(physics, margin=self.skin / 2.)
+        self.origin = np.zeros((0, 2))  # Positions at the last build
+        self.awake = np.zeros(0, dtype=bool)  # Awake balls at the last build
+        self.I = self.J = np.zeros(0, dtype=int)
+        self.builds = 0
+        self.frames = 0
+
+    def rebuild(self):
+        pairs = self.grid.pairs()
+        self.I = np.array([i for i, __ in pairs], dtype=int)
+        self.J = np.array([j for __, j in pairs], dtype=int)
+        self.origin = self.physics.position.copy()
+        self.awake = self.physics.awake
+        self.builds += 1
+
+    def update(self):
+        """ Rebuild the list if needed """
+        self.frames += 1
+        p = self.physics.position
+        # Pairs of sleeping balls are not listed, so a wake-up also rebuilds
+        if (len(self.origin) != len(p) or
+            (self.physics.awake & ~self.awake).any() or
+            ((p - self.origin)**2).sum(axis=1).max() > (self.skin / 2.)**2):
+            self.rebuild()
+
+    def pairs(self):
+        """ Sorted list of (i, j) index pairs of overlapping circles """
+        self.update()
+        return overlapping(self.physics, self.I, self.J)
+
+
+BROADPHASES = {
+    "sprite": SpriteCollide,
+    "hash":   SpatialHash,
+    "sap":    SweepAndPrune,
+    "verlet": NeighbourList,
+}
+if np is None:
+    BROADPHASES = {"sprite": SpriteCollide}
+    ENGINES = {"python": ScalarPhysics}
+
+
+class Palette(object):
+    """ 8-bit palette that colors balls by speed or kinetic energy
+
+        The palette is a blue to red ramp of LEVELS colors after the entries
+        for the background and the center of selected balls. A lookup table
+        maps speeds (or energies) to ramp indexes, and recolor() applies it
+        to all balls in one vectorized pass. A ball changes color by
+        changing index, with no circle ever drawn again.
+    """
+
+    BACKGROUND = 0  # Transparent
+    SELECTED = 1
+    LEVELS = 32
+    BINS = 1024     # Lookup table resolution
+
+    def __init__(self, mode):
+        self.mode = mode
+        ramp = [colorsys.hsv_to_rgb(2./3 * (1 - k / (self.LEVELS - 1.)), 1, 1)
+                for k in range(self.LEVELS)]
+        self.colors = [BG_COLOR, BLACK] + [tuple(int(255 * c) for c in rgb) for rgb in ramp]
+        self.colors += [BLACK] * (256 - len(self.colors))
+
+        # Square root curve, so slow balls still show some variation
+        self.lut = 2 + (np.sqrt(np.arange(self.BINS) / float(self.BINS)) *
+                        self.LEVELS).astype(int)
+        self.index = np.zeros(0, dtype=int)  # Palette index of each ball
+
+    def recolor(self, physics):
+        v2 = (physics.velocity**2).sum(axis=1)
+        if self.mode == "energy":
+            x = np.log1p(physics.mass * v2 / 2.) / math.log1p(ENERGY_MAX)
+        else:
+            x = np.sqrt(v2) / SPEED_MAX
+        self.index = self.lut[np.minimum((x * self.BINS).astype(int), self.BINS - 1)]
+
+
+class StampCache(object):
+    """ Ball images shared by all balls of same radius, color and selection
+
+        Stamps are converted to the display format and RLE-accelerated. The
+        least recently used ones are evicted when their memory goes over
+        budget bytes, and are drawn again when needed. Stamps used in the
+        current or the last frame, as counted by tick(), are never evicted,
+        so balls on screen keep theirs even when they need more than budget.
+
+        With a palette, stamps are 8-bit surfaces and colors are indexes.
+    """
+
+    def __init__(self, budget, palette=None):
+        self.budget = budget
+        self.palette = palette
+        self.size = 0  # Bytes used by the cached stamps
+        self.frame = 0
+        self.stamps = OrderedDict()  # By key, least recently used first
+        self.used = {}  # Frame of last use, by key
+
+    def __len__(self):
+        return len(self.stamps)
+
+    def tick(self):
+        """ Start a new frame """
+        self.frame += 1
+
+    def get(self, radius, color, selected=False):
+        key = (radius, color, selected)
+        stamp = self.stamps.get(key)
+        if stamp is None:
+            stamp = self.stamps[key] = self.draw(radius, color, selected)
+            self.size += stamp.get_pitch() * stamp.get_height()
+            self.used[key] = self.frame
+            while self.size > self.budget:
+                old = next(iter(self.stamps))
+                if self.used[old] >= self.frame - 1:
+                    break  # The least recently used is in use, and so are all the others
+                image = self.stamps.pop(old)
+                del self.used[old]
+                self.size -= image.get_pitch() * image.get_height()
+        else:
+            self.stamps.move_to_end(key)
+            self.used[key] = self.frame
+        return stamp
+
+    def draw(self, radius, color, selected):
+        if self.palette:
+            image = pygame.Surface(2*[radius*2], 0, 8)
+            image.set_palette(self.palette)
+            image.fill(Palette.BACKGROUND)
+            pygame.draw.circle(image, color, 2*(radius,), radius)
+            if selected:
+                pygame.draw.circle(image, Palette.SELECTED, 2*(radius,), int(radius/2))
+            image.set_colorkey(Palette.BACKGROUND, pygame.RLEACCEL)
+            return image
+
+        image = pygame.Surface(2*[radius*2])
+        image.fill(BG_COLOR)
+        pygame.draw.circle(image, color, 2*(radius,), radius)
+        if selected:
+            pygame.draw.circle(image, BLACK, 2*(radius,), int(radius/2))
+        image = image.convert()
+        image.set_colorkey(BG_COLOR, pygame.RLEACCEL)
+        return image
+
+
+def merge_rects(rects):
+    """ Merge overlapping rects into their unions, until none overlap """
+    merged = []
+    for rect in rects:
+        rect = pygame.Rect(rect)
+        i = rect.collidelist(merged)
+        while i != -1:
+            rect.union_ip(merged.pop(i))
+            i = rect.collidelist(merged)
+        merged.append(rect)
+    return merged
+
+
+class Renderer(object):
+    """ Draws all balls in a single Surface.blits call
+
+        The areas drawn in the previous frame are cleared in another single
+        blits call. Old and new areas are merged into a few non-overlapping
+        dirty rects for the display update, or the whole screen is updated
+        when they cover more than threshold of it.
+
+        Sleeping balls are baked into a static copy of the background, which
+        is what gets blitted when clearing, and are not drawn every frame.
+        When one wakes up, its area of the static layer is restored.
+    """
+
+    def __init__(self, screen, background, threshold=DIRTY_MAX):
+        self.screen = screen
+        self.background = background
+        self.threshold = threshold * screen.get_width() * screen.get_height()
+        self.reset()
+
+    def reset(self):
+        self.static = self.background.copy()
+        # Balls drawn in the static layer, and their areas by ball index.
+        # Without NumPy nothing is baked
+        self.baked = None if np is None else np.zeros(0, dtype=bool)
+        self.bakedrects = {}
+        self.drawn = []  # Screen areas drawn in the last frame
+
+    def clear(self):
+        """ Redraw the whole background, forgetting any drawn ball """
+        self.reset()
+        self.screen.blit(self.background, (0, 0))
+        pygame.display.flip()
+
+    def bake(self, physics):
+        """ Update the static layer, returning the areas of it that changed """
+        balls, asleep = physics.balls, physics.asleep
+        if len(self.baked) != len(asleep):
+            self.baked = np.hstack((self.baked,
+                                    np.zeros(len(asleep) - len(self.baked), dtype=bool)))
+
+        # Remove the balls that woke up, drawing back the neighbours they covered
+        woke = np.flatnonzero(self.baked & ~asleep).tolist()
+        restored = [self.bakedrects.pop(i) for i in woke]
+        self.baked[woke] = False
+        for rect in restored:
+            self.static.set_clip(rect)
+            self.static.blit(self.background, rect, rect)
+            self.static.blits([(balls[i].image, r)
+                               for i, r in rect.collidedictall(self.bakedrects, 1)],
+                              doreturn=False)
+        self.static.set_clip(None)
+
+        # Add the balls that fell asleep. Their area changed too, as they may
+        # have moved since they were last drawn
+        slept = np.flatnonzero(asleep & ~self.baked).tolist()
+        for i in slept:
+            self.bakedrects[i] = balls[i].rect.copy()
+        self.static.blits([(balls[i].image, balls[i].rect) for i in slept], doreturn=False)
+        self.baked[slept] = True
+        return restored + [self.bakedrects[i] for i in slept]
+
+    def render(self, physics, clear=False, trace=False):
+        """ Draw balls. Clear the whole screen, or leave trails if trace """
+        if stamps is not None:
+            stamps.tick()
+        changed = [] if self.baked is None else self.bake(physics)
+        if clear:
+            self.screen.blit(self.static, (0, 0))
+        else:
+            erased = changed if trace else self.drawn + changed
+            self.screen.blits([(self.static, rect, rect) for rect in erased],
+                              doreturn=False)
+        balls = physics.balls
+        indexes = (range(len(balls)) if self.baked is None else
+                   np.flatnonzero(~self.baked).tolist())
+        self.drawn = self.screen.blits([(balls[i].image, balls[i].rect) for i in indexes])
+
+        if clear:
+            pygame.display.flip()
+            return
+        dirty = merge_rects(erased + self.drawn)
+        if sum(rect.width * rect.height for rect in dirty) > self.threshold:
+            pygame.display.flip()
+        else:
+            pygame.display.update(dirty)
 
 
 class Ball(pygame.sprite.Sprite):
 
     REFMASS = math.pi * 10**2  # Reference mass = ball with radius 10 and density 1
 
-    def __init__(self, color=WHITE, radius=10, position=(), velocity=(), density=1,
+    def __init__(self, physics, color=WHITE, radius=10, position=(), velocity=(), density=1,
                  elasticity=1):
         super(Ball, self).__init__()
 
         # Basic properties
         self.color = color
         self.radius = radius
-        self.position = Vector2(*position) or Vector2(0, 0)
-        self.velocity = Vector2(*velocity) or Vector2(0, 0)
         self.density = density
         self.elasticity = elasticity
 
         # Derived properties
         self.area = math.pi * self.radius**2
         self.mass = self.area * self.density / self.REFMASS
-        self.bounds = (screen.get_size()[0] - self.radius,
-                       screen.get_size()[1] - self.radius)
-        self.wallp = Vector2(0, 0)  # net momentum "absorbed" by the "infinite-mass" walls. What a dirty hack :P
 
-        # Pygame sprite requirements
-        self.image = pygame.Surface(2*[self.radius*2])
-        self.rect = self.image.get_rect()
+        # Position, velocity and wall momentum live in the physics engine of its world
+        self.physics = physics
+        self.index = physics.add(self, position or (0, 0), velocity or (0, 0))
+
+        # Pygame sprite requirements. The image is a shared stamp
+        self.selected = False
+        self.rect = pygame.Rect(0, 0, 2*self.radius, 2*self.radius)
         self.move((0, 0))
-        self.image.fill(BG_COLOR)
-        self.image.set_colorkey(BG_COLOR)
-        pygame.draw.circle(self.image, self.color, 2*(self.radius,), self.radius)
+
+    @property
+    def image(self):
+        """ Headless balls have no image """
+        if palette is not None:
+            return stamps.get(self.radius, int(palette.index[self.index]), self.selected)
+        if stamps is not None:
+            return stamps.get(self.radius, self.color, self.selected)
+
+    @property
+    def position(self):
+        return Vector2(*self.physics.get(self.index, 'position'))
+
+    @position.setter
+    def position(self, value):
+        self.physics.set(self.index, 'position', tuple(value))
+
+    @property
+    def velocity(self):
+        return Vector2(*self.physics.get(self.index, 'velocity'))
+
+    @velocity.setter
+    def velocity(self, value):
+        self.physics.set(self.index, 'velocity', tuple(value))
+
+    @property
+    def wallp(self):
+        """ Net momentum "absorbed" by the "infinite-mass" walls. What a dirty hack :P """
+        return Vector2(*self.physics.get(self.index, 'wallp'))
+
+    @wallp.setter
+    def wallp(self, value):
+        self.physics.set(self.index, 'wallp', tuple(value))
+
+    @property
+    def bounds(self):
+        return tuple(self.physics.get(self.index, 'bounds'))
 
     @property
     def momentum(self):
@@ -137,160 +2173,829 @@ class Ball(pygame.sprite.Sprite):
         """ Potential (gravitational) energy: Eu = mh|g| """
         # Disregard horizontal gravity for now.
         # Accurate result would be m * sqrt((gx*hx)²+(gy*hy)²)
-        return self.mass * abs(GRAVITY[1]) * (self.position[1] - self.radius)
+        return (self.mass * abs(self.physics.gravity_of(self.index)[1]) *
+                (self.position[1] - self.radius))
 
     @property
     def on_ground(self):
         return self.position[1] == self.radius
 
 
+    @property
+    def asleep(self):
+        return bool(self.physics.get(self.index, 'asleep'))
+
+    def wake(self):
+        self.physics.wake(self.index)
+
     def select(self):
+        self.wake()
         self.wallp = Vector2(0, 0)
-        pygame.draw.circle(self.image, BLACK, 2*(self.radius,), int(self.radius/2))
+        self.selected = True
 
     def deselect(self):
         self.wallp = Vector2(0, 0)
-        pygame.draw.circle(self.image, self.color, 2*(self.radius,), self.radius)
+        self.selected = False
 
     def move(self, delta):
-        self.position += delta
-        self.rect.center = (int(self.position[0]),
-                            int(screen.get_size()[1] - self.position[1]))
+        self.physics.move(self.index, delta)
 
+    def collide(self, other):
+        # Do nothing on self "collisions"
+        if other is not self:
+            self.physics.collide(self.index, other.index)
 
-    def update(self, elapsed=None):
-        super(Ball, self).update()
 
-        if elapsed is None:
-            elapsed = TIMESTEP
+    def printdata(self, comment):
+        if self.physics.debug:
+            print("id=%s p=%s v=%s %s" % (
+                self.color, self.position, self.velocity, comment))
 
-        # dt should be constant and small, 1./60 is perfect. But I shall not enforce this here
-        dt = elapsed  # Alternatives: TIMESTEP; 1./FPS; 1./60
 
-        def bounce():
-            # Save the momentum that will be absorbed by the wall
-            self.wallp[i] += self.mass * 2 * self.velocity[i]
 
-            # Reflect velocity, dampered
-            self.velocity[i] *= -1 * DAMPING[i]
 
-            # set to zero when low enough
-            if abs(self.velocity[i]) < EPSILON_V:
-                self.velocity[i] = 0
+def create_balls(physics, count, radii=None, speed=None, elasticity=None, rng=random):
+    """ Add count random balls to physics and return them
 
-        if self.velocity == [0, 0] and self.on_ground:
-            return
+        Radii range over radii (min, max), velocities over speed (x, y) both
+        ways, defaulting to 10 up to the radius global, and to vel and elast.
+        Random numbers come from rng, a random.Random or the random module.
+    """
+    size = physics.size
+    low, high = (10, radius) if radii is None else radii
+    vx, vy = vel if speed is None else speed
+    elasticity = elast if elasticity is None else elasticity
+    return [Ball(physics, color=(rng.randint(0,255), rng.randint(0,255), rng.randint(0,255)),
+                 radius=rng.randint(low, high), elasticity=elasticity,
+                 position=[rng.randint(100, size[0]-high),
+                           rng.randint(100, size[1]-high)],
+                 velocity=[rng.randint(-vx, vx), rng.randint(-vy, vy)],
+                 )
+            for __ in range(count)]
 
-        # Apply gravity to velocity
-        if not (self.on_ground and self.velocity[1] == 0):
-            self.velocity += GRAVITY * dt
 
-        # Apply velocity to position, Implicit Euler method
-        self.move(self.velocity * SCALE * dt)
+def advance(physics, broadphase, elapsed=None):
+    """ Run one simulation step: update, then collision detection and resolution """
+    physics.update(elapsed)
+    collide(physics, broadphase)
+
+
+def collide(physics, broadphase):
+    if physics.events:
+        return  # No candidate pairs needed
+    physics.stats.candidates += physics.resolve(broadphase.pairs())
+
+
+def random_color(rng):
+    return (rng.randint(0,255), rng.randint(0,255), rng.randint(0,255))
+
+
+def scene_gas(physics, rng):
+    """ Sparse gas: few small fast balls, no gravity, no energy loss """
+    size = physics.size
+    return [Ball(physics, color=random_color(rng), radius=10, elasticity=1,
+                 position=[rng.uniform(10, size[0]-10), rng.uniform(10, size[1]-10)],
+                 velocity=[rng.uniform(-10, 10), rng.uniform(-10, 10)])
+            for __ in range(size[0] * size[1] // 20000)]
+
+
+def scene_pile(physics, rng):
+    """ Dense pile: a lattice of touching balls filling the lower two thirds """
+    size, r = physics.size, 20
+    return [Ball(physics, color=random_color(rng), radius=r, elasticity=elast,
+                 position=[x, y], velocity=[rng.uniform(-0.1, 0.1), 0])
+            for y in range(r, 2 * size[1] // 3, 2*r + 1)
+            for x in range(r + (y // (2*r + 1)) % 2 * r, size[0] - r, 2*r + 1)]
+
+
+def scene_uniform(physics, rng):
+    """ Same-radius balls at random positions, as main() places them """
+    size, r = physics.size, 30
+    return [Ball(physics, color=random_color(rng), radius=r, elasticity=elast,
+                 position=[rng.randint(100, size[0]-r), rng.randint(100, size[1]-r)],
+                 velocity=[rng.randint(-vel[0], vel[0]), rng.randint(-vel[1], vel[1])])
+            for __ in range(300)]
+
+
+def scene_mixed(physics, rng):
+    """ Radii from 10 to 120, as main() creates them """
+    return create_balls(physics, 100, rng=rng)
+
+
+def scene_crowd(physics, rng):
+    """ Overlapping random balls, as main() places them, with no gravity so
+        the event engine runs it too
+    """
+    return create_balls(physics, 80, rng=rng)
+
+
+def scene_bounce(physics, rng):
+    """ Balls bouncing in columns of their own, never colliding, so that only
+        the integrator and the walls change their energy
+    """
+    size, r = physics.size, 10
+    return [Ball(physics, color=random_color(rng), radius=r, elasticity=elast,
+                 position=[x, rng.uniform(r, size[1] - r)],
+                 velocity=[0, rng.uniform(-vel[1], vel[1])])
+            for x in range(2*r, size[0] - r, 3*r)]
+
+
+def scene_impact(physics, rng):
+    """ High-speed impacts: balls ten times faster than in main() """
+    size = physics.size
+    return [Ball(physics, color=random_color(rng), radius=rng.randint(15, 30), elasticity=elast,
+                 position=[rng.randint(100, size[0]-30), rng.randint(100, size[1]-30)],
+                 velocity=[rng.uniform(-10, 10) * vel[0], rng.uniform(-10, 10) * vel[1]])
+            for __ in range(100)]
+
+
+# Benchmark scenes: Physics options and ball factory, of the physics and a random.Random
+SCENES = {
+    "gas":     (dict(gravity=(0, 0), damping=(1, 1), friction=0), scene_gas),
+    "pile":    ({}, scene_pile),
+    "uniform": ({}, scene_uniform),
+    "mixed":   ({}, scene_mixed),
+    "crowd":   (dict(gravity=(0, 0)), scene_crowd),
+    "impact":  ({}, scene_impact),
+    "bounce":  (dict(damping=(1, 1), friction=0), scene_bounce),
+}
+
+
+class World(object):
+    """ A simulation: bounds, physics constants, balls, broad-phase and stats
+
+        Worlds need no display and share no state, so any number of them can
+        be created, stepped and discarded in a process. Options left as None
+        take the module defaults, GRAVITY, DAMPING, FRICTION, TIMESTEP,
+        INTEGRATOR, ENGINE and BROADPHASE, or what NumPy-less runs fall back to.
+        Other options are the engine tuning of Engine.configure(), such as
+        narrowphase or sleep_frames, also defaulting to the module globals.
+        seed seeds the world's own random.Random, which places its balls.
+    """
+
+    def __init__(self, size, gravity=None, damping=None, friction=None, timestep=None,
+                 integrator=None, engine=None, broadphase=None, physics=None, seed=None,
+                 **options):
+        if engine is None:
+            engine = ENGINE if ENGINE in ENGINES else "python"
+        if broadphase is None:
+            broadphase = BROADPHASE if BROADPHASE in BROADPHASES else "sprite"
+        if physics is None:
+            physics = ENGINES[engine](size, gravity, damping, friction, integrator,
+                                      timestep, **options)
+        self.physics = physics  # Or an existing engine, ignoring the options above
+        self.broadphase = BROADPHASES[broadphase](self.physics)
+        self.random = random.Random(seed)
+        self.frames = 0  # Steps taken
+        self.started = False
+
+    @classmethod
+    def scene(cls, name, size, seed=0, **options):
+        """ A new world with the named scene, seeded. options take precedence
+            over the scene's
+        """
+        defaults, factory = SCENES[name]
+        world = cls(size, seed=seed, **dict(defaults, **options))
+        factory(world.physics, world.random)
+        return world
+
+    @classmethod
+    def stack(cls, worlds, broadphase=None):
+        """ A new world stepping the numpy engine worlds as an Ensemble
+
+            Energy and momentum become arrays, one row per stacked world.
+            The worlds are left unusable.
+        """
+        if broadphase == "sprite":
+            raise ValueError("Ensembles have no sprite rects for the sprite broad-phase")
+        ensemble = Ensemble(world.physics for world in worlds)
+        return cls(ensemble.size, broadphase=broadphase, physics=ensemble)
+
+    def __len__(self):
+        return len(self.physics)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
-        # Check wall collisions
-        for i in [0, 1]:
-            # Boundary checks
-            if self.position[i] < self.radius:
-                self.position[i] = self.radius
-                self.move((0, 0))
-                bounce()
-            elif self.position[i] > self.bounds[i]:
-                self.position[i] = self.bounds[i]  # Reflection would be self.bounds[i]-(self.position[i]-self.bounds[i])
-                self.move((0, 0))
-                bounce()
-            # Reset wall momentum if ball stops
-            if abs(self.velocity[i]) < EPSILON_V:
-                self.wallp[i] = 0
+    @property
+    def size(self):
+        return self.physics.size
 
-        # Apply friction if ball is sliding on ground
-        if self.on_ground and self.velocity[1] == 0:
-            self.velocity[0] -= math.copysign(min(abs(self.velocity[0]),
-                                                  abs(GRAVITY[1] * FRICTION * dt)),
-                                               self.velocity[0])
-            # Make it stop if low enough
-            if abs(self.velocity[0]) < EPSILON_V:
-                self.velocity[0] = 0
+    @property
+    def gravity(self):
+        return self.physics.gravity
 
+    @property
+    def damping(self):
+        return self.physics.damping
 
-    def collide(self, other):
-        # Do nothing on self "collisions" or when center coincide
-        if other is self or self.position == other.position:
-            return
+    @property
+    def friction(self):
+        return self.physics.friction
 
-        # Calculate the distance vector and its magnitude squared
-        ds = other.position - self.position
-        mag2 = ds.magnitude_squared()
+    @property
+    def timestep(self):
+        return self.physics.timestep
 
-        # Check for false positives from rect collision detection
-        # by testing if distance^2 >= (sum of radii)^2
-        radsum = self.radius + other.radius
-        if mag2 >= radsum**2:
-            self.printdata("False Positive")
-            return
+    @property
+    def balls(self):
+        return self.physics.balls
 
-        # Calculate the distance vector magnitude (= the distance between the balls)
-        # Also calculate the overlap width (= distance - sum of radii)
-        dvmag = math.sqrt(mag2)
-        overlap = abs(dvmag - radsum)
+    @property
+    def stats(self):
+        return self.physics.stats
 
-        if args.debug:
-            print("collide! %r %r at %s, %.2f overlap" % (
-                self.color, other.color, self.position, overlap))
+    @property
+    def energy(self):
+        return self.physics.energy
 
-        # Some constants
-        CR = min(self.elasticity, other.elasticity)
-        invmass = 1. / (self.mass + other.mass)
+    @property
+    def momentum(self):
+        return self.physics.momentum
 
-        # Calculate the normal, the unit vector from centers to collision point
-        # It always points in direction from self towards other
-        normal = ds/dvmag
+    @property
+    def resting(self):
+        return self.physics.resting
 
-        # Rotate the normal 90º to find the tangent vector
-        tangent = Vector2(-normal[1], normal[0])
+    @property
+    def time(self):
+        """ Simulated time, in seconds """
+        return self.frames * self.timestep
+
+    def add(self, **options):
+        """ Add a ball with the given Ball options and return it """
+        return Ball(self.physics, **options)
+
+    def populate(self, count, **options):
+        """ Add count random balls, as main() does, and return them
+
+            options are the radii, speed and elasticity of create_balls().
+        """
+        return create_balls(self.physics, count, rng=self.random, **options)
+
+    def start(self):
+        """ Settle the initial state: sync rects, sleep and energy totals """
+        self.physics.update(0)
+        self.started = True
+
+    def step(self, frames=1):
+        """ Advance frames timesteps, starting the world if needed """
+        if not self.started:
+            self.start()
+        for __ in range(frames):
+            advance(self.physics, self.broadphase, self.timestep)
+        self.frames += frames
+
+    def close(self):
+        """ Release the balls and the engine. The world is unusable afterwards """
+        for ball in self.balls:
+            if ball.physics is self.physics:  # Not moved over to an ensemble
+                ball.physics = None
+        self.physics = self.broadphase = None
+
+
+def world_options(args):
+    """ World options from the command line """
+    return dict(timestep=1./args.hz, integrator=args.integrator, engine=args.engine,
+                broadphase=args.broadphase, narrowphase=args.narrowphase,
+                iterations=args.iterations, slop=args.slop, skin=args.skin,
+                debug=args.debug)
+
+
+def open_display(size):
+    """ Set the screen, background, stamps and renderer singletons for a benchmark run """
+    global screen, background, stamps, renderer
+    pygame.display.init()
+    screen = pygame.display.set_mode(size)
+    stamps = StampCache(STAMP_BUDGET * 2**20)
+    background = pygame.Surface(screen.get_size())
+    background.fill(BG_COLOR)
+    renderer = Renderer(screen, background)
 
-        # Project the velocities along the normal and tangent
-        uan = self.velocity.project(normal)
-        uat = self.velocity.project(tangent)
 
-        ubn = other.velocity.project(normal)
-        ubt = other.velocity.project(tangent)
+def percentiles(times):
+    """ min, median, p95 and p99 of times in ns, as a dict in ms """
+    ms = np.array(times) / 10.**6
+    return dict(min=ms.min(), median=np.median(ms),
+                p95=np.percentile(ms, 95), p99=np.percentile(ms, 99))
 
-        # Apply momentum conservation for inelastic collision along the normal components
-        # See https://en.wikipedia.org/wiki/Coefficient_of_restitution#Equation
-        dvn = ubn - uan
-        pn  = uan * self.mass + ubn * other.mass
-        van = (pn + dvn * other.mass * CR) * invmass
-        vbn = (pn - dvn * self.mass  * CR) * invmass
 
-        # Update the velocities, adding normal and tangent components
-        self.velocity  = van + uat
-        other.velocity = vbn + ubt
+def write_json(results, output):
+    if output:
+        with open(output, 'w') as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+
+def benchmark(args):
+    """ Run each benchmark scene for a fixed number of frames and report timings
+
+        Update, collision and render times of every frame are measured with
+        perf_counter_ns and summarized as min, median, p95 and p99, in ms.
+        Results are written as JSON to args.output, or to stdout.
+    """
+    if not args.headless:
+        open_display(args.size)
+
+    ns = time.perf_counter_ns
+    results = dict(seed=args.seed, frames=args.frames, hz=args.hz,
+                   size=list(args.size), engine=args.engine, integrator=args.integrator,
+                   narrowphase=args.narrowphase, broadphase=args.broadphase,
+                   scenes={})
+    for name in args.suite or sorted(SCENES):
+        world = World.scene(name, args.size, args.seed, **world_options(args))
+        physics, broadphase = world.physics, world.broadphase
+        if screen:
+            renderer.clear()
+        world.start()
+        times = dict(update=[], collide=[], render=[])
+        for __ in range(args.frames):
+            t0 = ns()
+            physics.update()
+            t1 = ns()
+            collide(physics, broadphase)
+            t2 = ns()
+            if screen:
+                renderer.render(physics)
+            t3 = ns()
+            times['update'].append(t1 - t0)
+            times['collide'].append(t2 - t1)
+            times['render'].append(t3 - t2)
+        if not screen:
+            del times['render']
+        results['scenes'][name] = dict(balls=len(physics), stats=physics.stats.asdict(),
+                                       **{k: percentiles(v) for k, v in times.items()})
+        print("%-8s %5d balls: %s" % (name, len(physics), ", ".join(
+              "%s %.3f/%.3f ms" % (k, v['median'], v['p99'])
+              for k, v in sorted(results['scenes'][name].items()) if k in times)),
+              file=sys.stderr)
+
+    write_json(results, args.output)
+    pygame.quit()
+    return True
 
-        # Move circles away at normal direction
-        # Each ball is displaced a fraction of offset inversely proportional to its mass
-        self.move(-normal * overlap * other.mass * invmass)
-        other.move(normal * overlap * self.mass  * invmass)
 
+def scaling(args):
+    """ Measure how the per-frame cost of each phase grows with the ball count
+
+        Ball counts double from 10 up to args.scaling, placed as in main().
+        Each phase median is reported per count, plus the exponent k of a
+        cost ~ N^k fit and the highest count whose physics fits a timestep.
+        The series stops early once a frame takes over MAX_FRAME seconds.
+    """
+    MAX_FRAME = 1.
+    if not args.headless:
+        open_display(args.size)
+
+    ns = time.perf_counter_ns
+    phases = ('update', 'broad', 'narrow') + (('render',) if screen else ())
+    counts = []
+    medians = dict((phase, []) for phase in phases)
+    print("%6s  %s" % ("balls", "  ".join("%9s" % _ for _ in phases)), file=sys.stderr)
+    count = 10
+    while count <= args.scaling:
+        world = World(args.size, seed=args.seed, **world_options(args))
+        world.populate(count)
+        physics, broadphase, timestep = world.physics, world.broadphase, world.timestep
+        if screen:
+            renderer.clear()
+        world.start()
+        times = dict((phase, []) for phase in phases)
+        for __ in range(args.frames):
+            t0 = ns()
+            physics.update()
+            t1 = ns()
+            pairs = list(broadphase.pairs())
+            t2 = ns()
+            physics.resolve(pairs)
+            t3 = ns()
+            if screen:
+                renderer.render(physics)
+                times['render'].append(ns() - t3)
+            times['update'].append(t1 - t0)
+            times['broad'].append(t2 - t1)
+            times['narrow'].append(t3 - t2)
+            if (ns() - t0) / 10.**9 > MAX_FRAME:
+                break
+        counts.append(count)
+        for phase in phases:
+            medians[phase].append(np.median(times[phase]) / 10.**6)
+        print("%6d  %s" % (count, "  ".join("%9.3f" % medians[phase][-1]
+                                            for phase in phases)), file=sys.stderr)
+        if (ns() - t0) / 10.**9 > MAX_FRAME:
+            break
+        count *= 2
+
+    def exponent(times):
+        # Slope of the log-log least squares fit, ignoring unmeasurable times
+        x, y = np.log(counts), np.array(times)
+        keep = y > 0
+        if keep.sum() < 2:
+            return None
+        return np.polyfit(x[keep], np.log(y[keep]), 1)[0]
+
+    physics_ms = (np.array(medians['update']) + np.array(medians['broad']) +
+                  np.array(medians['narrow']))
+    fits = [n for n, ms in zip(counts, physics_ms) if ms <= timestep * 1000]
+    results = dict(seed=args.seed, frames=args.frames, hz=1./timestep,
+                   size=list(args.size), engine=args.engine, integrator=args.integrator,
+                   narrowphase=args.narrowphase, broadphase=args.broadphase,
+                   counts=counts, median_ms=medians,
+                   exponent=dict((phase, exponent(medians[phase])) for phase in phases),
+                   max_balls=max(fits) if fits else None)
+    print("%6s  %s" % ("k", "  ".join("%9.2f" % (results['exponent'][phase] or 0)
+                                      for phase in phases)), file=sys.stderr)
+    print("Most balls within a timestep: %s" % results['max_balls'], file=sys.stderr)
+    write_json(results, args.output)
+    pygame.quit()
+    return True
+
+
+def drift(args):
+    """ Compare the integrators on energy drift and cost per step
+
+        Each scene runs with every integrator at each step rate of DRIFT_HZ,
+        for the simulated time of args.frames steps at args.hz. Wall damping,
+        friction and sleeping lose energy by design, so they are disabled.
+        Clamping balls back onto the walls adds potential energy, which is
+        reported apart as clamp. What is left of the energy change is the
+        drift. In the bounce scene, with no collisions, it comes from the
+        integrator alone, in flight and at the bounces.
+
+        The energy shown in the caption adds m|v|²/2, with v in speed, to
+        mh|g|, with h in pixels. Here the potential energy is divided by
+        SCALE, so that both are in the same units and a ball in free fall
+        keeps its energy.
+
+        Reports the energy drift and clamp per simulated second, the drift
+        also relative to the initial energy, the median cost per step, and
+        the simulated seconds per CPU second. For each scene and integrator,
+        stable_hz is the lowest rate, the largest timestep, with relative
+        drift within DRIFT_MAX. Results are written as JSON to args.output,
+        or to stdout.
+    """
+    ns = time.perf_counter_ns
+    seconds = args.frames / args.hz
+
+    def energy(physics):
+        physics.recompute()
+        return physics.totals[0] + physics.totals[1] / SCALE
+
+    results = dict(seed=args.seed, seconds=seconds, size=list(args.size),
+                   engine=args.engine, narrowphase=args.narrowphase,
+                   broadphase=args.broadphase, drift_max=DRIFT_MAX, scenes={})
+    for name in args.drift or sorted(SCENES):
+        results['scenes'][name] = {}
+        for integrator in sorted(INTEGRATORS):
+            runs = []
+            for hz in DRIFT_HZ:
+                world = World.scene(name, args.size, args.seed,
+                                    **dict(world_options(args), timestep=1./hz,
+                                           integrator=integrator, damping=(1, 1),
+                                           friction=0, sleep_frames=0))
+                physics, broadphase = world.physics, world.broadphase
+                world.start()
+                initial, clamp = energy(physics), physics.stats.clamp
+                times = []
+                for __ in range(int(round(seconds * hz))):
+                    t0 = ns()
+                    advance(physics, broadphase)
+                    times.append(ns() - t0)
+                clamp = (physics.stats.clamp - clamp) / SCALE / seconds
+                rate = (energy(physics) - initial) / seconds - clamp
+                runs.append(dict(hz=hz, drift=rate, clamp=clamp,
+                                 relative=rate / abs(initial) if initial else 0.,
+                                 step=percentiles(times)['median'],
+                                 throughput=seconds / (sum(times) / 10.**9)))
+                print("%-8s %-8s %4d Hz: drift % .3e/s (% 7.3f%%/s), clamp % .3e/s,"
+                      " step %.3f ms, %.1f simulated s/s" % (name, integrator, hz, rate,
+                      100 * runs[-1]['relative'], clamp, runs[-1]['step'],
+                      runs[-1]['throughput']), file=sys.stderr)
+            stable = [run['hz'] for run in runs if abs(run['relative']) <= DRIFT_MAX]
+            results['scenes'][name][integrator] = dict(runs=runs,
+                                                       stable_hz=min(stable) if stable else None)
+
+    write_json(results, args.output)
+    return True
+
+
+def sweep_range(value):
+    """ Integers FIRST..LAST, or a single one """
+    first, __, last = value.partition('..')
+    return list(range(int(first), int(last or first) + 1))
+
+
+def sweep_pair(value, kind=float, low=None):
+    """ A pair A:B, or B paired with low, or with itself """
+    a, __, b = value.rpartition(':')
+    b = kind(b)
+    return [(kind(a) if a else b if low is None else low, b)]
+
+
+# Sweep parameters, and the parser of their values into lists
+SWEEP = OrderedDict((
+    ('balls',    sweep_range),
+    ('radius',   lambda value: sweep_pair(value, int, 10)),
+    ('vel',      lambda value: sweep_pair(value, int)),
+    ('damping',  sweep_pair),
+    ('friction', lambda value: [float(value)]),
+    ('elast',    lambda value: [float(value)]),
+    ('seed',     sweep_range),
+))
+
+
+def sweep_params(params):
+    """ params with the types the SWEEP parsers give, so that equal runs have
+        equal keys: the default elast is 1, where elast=1 parses to 1.0
+    """
+    kinds = dict(balls=int, radius=int, vel=int, damping=float, friction=float,
+                 elast=float, seed=int)
+    return dict((name, tuple(kinds[name](_) for _ in value)
+                 if isinstance(value, (list, tuple)) else kinds[name](value))
+                for name, value in params.items())
+
+
+def sweep_run(params, size, frames, budget, options):
+    """ One headless --sweep run of params, a dict of every SWEEP parameter
+
+        Runs for frames steps, or budget seconds, or until the world rests,
+        as nothing moves after that. rest is the simulated time it took.
+        options are the other World options.
+    """
+    world = World(size, damping=params['damping'], friction=params['friction'],
+                  seed=params['seed'], **options)
+    world.populate(params['balls'], radii=params['radius'], speed=params['vel'],
+                   elasticity=params['elast'])
+    world.start()
+    start = time.perf_counter()
+    while world.frames < frames and not world.resting:
+        world.step()
+        if budget and time.perf_counter() - start > budget:
+            break
+    elapsed = max(time.perf_counter() - start, EPSILON)
+    world.physics.recompute()
+    result = dict(params=params, frames=world.frames, time=world.time, cpu=elapsed,
+                  fps=world.frames / elapsed, throughput=world.time / elapsed,
+                  rest=world.time if world.resting else None,
+                  energy=float(world.energy), momentum=[float(_) for _ in world.momentum],
+                  stats=world.stats.asdict())
+    world.close()
+    return result
+
+
+def sweep(args):
+    """ Run every combination of the --sweep grid headless, in a process pool
+
+        Parameters left out of the grid take the --balls and --seed options,
+        and the radius, vel, DAMPING, FRICTION and elast defaults. Each run
+        lasts --frames steps, or --budget seconds, or until the world rests.
+
+        Results stream as JSON lines to args.output, or to stdout, as runs
+        finish: the parameters, steps per second, simulated seconds per
+        second, time to rest and final energy and momentum. Runs already in
+        the output file are skipped, so an interrupted sweep resumes.
+
+        A run that raises is written as its parameters and the error, and
+        the sweep goes on. Returns False if any run failed.
+    """
+    grid = dict(balls=[args.balls], radius=[(10, radius)], vel=[tuple(vel)],
+                damping=[tuple(DAMPING)], friction=[FRICTION], elast=[elast],
+                seed=[args.seed])
+    grid.update(args.sweep)
+    runs = [sweep_params(dict(zip(SWEEP, values)))
+            for values in itertools.product(*[grid[name] for name in SWEEP])]
+
+    def key(params):
+        return json.dumps(sweep_params(params), sort_keys=True)
+
+    # Completed runs of an earlier sweep. A line cut short is run again
+    done, partial = set(), False
+    if args.output and os.path.exists(args.output):
+        with open(args.output) as fp:
+            text = fp.read()
+        partial = bool(text) and not text.endswith("\n")
+        for line in text.splitlines():
+            try:
+                done.add(key(json.loads(line)['params']))
+            except (ValueError, KeyError, TypeError):
+                pass
+    todo = [params for params in runs if key(params) not in done]
+    workers = args.workers or os.cpu_count()
+    print("Sweep: %d runs, %d done, %d workers" % (len(runs), len(runs) - len(todo), workers),
+          file=sys.stderr)
+
+    output = open(args.output, 'a') if args.output else sys.stdout
+    failed = 0
+    try:
+        if partial:
+            output.write("\n")
+        with ProcessPoolExecutor(workers) as pool:
+            futures = dict((pool.submit(sweep_run, params, args.size, args.frames, args.budget,
+                                        world_options(args)), params)
+                           for params in todo)
+            for count, future in enumerate(as_completed(futures), len(runs) - len(todo) + 1):
+                params = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = dict(params=params, error="%s: %s" % (type(e).__name__, e))
+                    failed += 1
+                output.write(json.dumps(result, sort_keys=True) + "\n")
+                output.flush()
+                name = " ".join("%s=%s" % (_, params[_]) for _ in SWEEP)
+                if 'error' in result:
+                    print("%d/%d %s: %s" % (count, len(runs), name, result['error']),
+                          file=sys.stderr)
+                    continue
+                print("%d/%d %s: %.0f steps/s, rest %s, energy %.3e" % (
+                      count, len(runs), name, result['fps'],
+                      "%.2fs" % result['rest'] if result['rest'] is not None
+                      else "-", result['energy']), file=sys.stderr)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    if failed:
+        print("Sweep: %d runs failed" % failed, file=sys.stderr)
+    return not failed
+
+
+def print_benchmark(updatetimes, rendertimes, fpslist, broadphase, timestep, fps):
+    def printtimes(name, times, limit, lowerisbetter=False):
+        fail = sum(1 for x in times if (x<limit if lowerisbetter else x>limit))
+        total = len(times)
+        failp = 100. * fail / total
+        print(("%s: " + 6*"%3d  ") % (
+            name, min(times), sum(times)/total, max(times), limit, fail, failp))
+    print(     "t (ms): min, avg, max, top, fail   %")
+    printtimes("Update", updatetimes, timestep*1000)
+    if rendertimes:
+        printtimes("Render", rendertimes, timestep*1000)
+    printtimes("FPS   ", fpslist, fps or 1./timestep, True)
+    if isinstance(broadphase, NeighbourList):
+        print("Neighbour lists: %d builds in %d frames" % (
+            broadphase.builds, broadphase.frames))
+
+
+def headless(args):
+    """ Run the physics alone for a fixed number of frames, with no display
+
+        Prints the same statistics as --benchmark, minus rendering. FPS is
+        measured over windows of 15 frames.
+    """
+    world = World(args.size, **world_options(args))
+    world.populate(args.balls)
+
+    updatetimes = []
+    fpslist = []
+    world.start()
+    start = time.time()
+    for frame in range(1, args.frames + 1):
+        t1 = time.time()
+        world.step()
+        updatetimes.append(1000 * (time.time() - t1))
+        if frame % 15 == 0:
+            now = time.time()
+            fpslist.append(15 / max(now - start, EPSILON))
+            start = now
+
+    if fpslist:
+        print_benchmark(updatetimes, [], fpslist, world.broadphase, world.timestep, 0)
+        print("Totals: %s" % world.stats)
+    return True
 
-    def printdata(self, comment):
-        if args.debug:
-            print("id=%s p=%s v=%s %s" % (
-                self.color, self.position, self.velocity, comment))
 
+def parse_args(argv=None):
+    def size(value):
+        try:
+            return tuple(int(_) for _ in value.lower().split('x', 1))
+        except ValueError:
+            raise argparse.ArgumentTypeError("invalid size: %r" % value)
 
+    def grid(value):
+        try:
+            name, values = value.split('=', 1)
+            return name, [_ for item in values.split(',') for _ in SWEEP[name](item)]
+        except (KeyError, ValueError):
+            raise argparse.ArgumentTypeError("invalid sweep parameter: %r" % value)
+
+    parser = argparse.ArgumentParser(description="A Rain of Balls")
+    parser.add_argument('--fullscreen', action='store_true', default=FULLSCREEN,
+                        help="Use the whole desktop")
+    parser.add_argument('--benchmark', action='store_true', default=BENCHMARK,
+                        help="Render unbounded for 10 seconds and print timings")
+    parser.add_argument('--debug', action='store_true', default=DEBUG,
+                        help="Print ball data on collisions and steps")
+    parser.add_argument('--stats', action='store_true',
+                        help="Show the physics counters of the last frame in the caption")
+    parser.add_argument('--color', choices=("ball", "speed", "energy"), default=COLORING,
+                        help="Ball colors: their own, or by speed or kinetic energy."
+                             " [Default: %(default)s]")
+    parser.add_argument('--stamp-budget', type=float, default=STAMP_BUDGET, metavar='MB',
+                        help="Memory for cached ball images. The images of the last"
+                             " frame are kept over it. [Default: %(default)s]")
+    parser.add_argument('--dirty-max', type=float, default=DIRTY_MAX, metavar='FRACTION',
+                        help="Dirty screen fraction above which the whole screen"
+                             " is updated. [Default: %(default)s]")
+    parser.add_argument('--fps', type=int, default=FPS,
+                        help="Render rate, 0 for unbounded. [Default: %(default)s]")
+    parser.add_argument('--hz', type=float, default=HZ,
+                        help="Physics steps per second. [Default: %(default)s]")
+    parser.add_argument('--engine', choices=sorted(ENGINES),
+                        default=ENGINE if ENGINE in ENGINES else "python",
+                        help="Physics engine: NumPy arrays, plain Python for when"
+                             " NumPy is not available, where balls moving more than"
+                             " their radius per step may pass through each other,"
+                             " or event-driven for gases, with no gravity."
+                             " [Default: %(default)s]")
+    parser.add_argument('--broadphase', choices=sorted(BROADPHASES),
+                        default=BROADPHASE if BROADPHASE in BROADPHASES else "sprite",
+                        help="Collision broad-phase. TAB cycles at runtime."
+                             " [Default: %(default)s]")
+    parser.add_argument('--integrator', choices=sorted(INTEGRATORS), default=INTEGRATOR,
+                        help="Integration scheme of the physics update."
+                             " [Default: %(default)s]")
+    parser.add_argument('--narrowphase', choices=("batch", "pair", "impulse"),
+                        default=NARROWPHASE,
+                        help="Collision resolution of the numpy engine: vectorized"
+                             " in conflict-free batches, pair by pair, or by the"
+                             " iterative contact solver. [Default: %(default)s]")
+    parser.add_argument('--iterations', type=int, default=ITERATIONS,
+                        help="Maximum iterations of the impulse narrow-phase per step."
+                             " [Default: %(default)s]")
+    parser.add_argument('--slop', type=float, default=SLOP,
+                        help="Overlap left uncorrected by the impulse narrow-phase,"
+                             " in pixels. [Default: %(default)s]")
+    parser.add_argument('--skin', type=float, default=SKIN,
+                        help="Skin margin of the verlet broad-phase, in pixels."
+                             " [Default: %(default)s]")
+    parser.add_argument('--balls', type=int, default=BALLS,
+                        help="Number of balls. [Default: %(default)s]")
+    parser.add_argument('--headless', action='store_true',
+                        help="Run only the physics, with no display, and print"
+                             " the --benchmark timings")
+    parser.add_argument('--size', type=size, default=SCREEN_SIZE,
+                        help="World size for --headless, --suite, --scaling, --drift and"
+                             " --sweep, as WIDTHxHEIGHT."
+                             " [Default: %dx%d]" % SCREEN_SIZE)
+    parser.add_argument('--frames', type=int, default=600,
+                        help="Frames to simulate in --headless, --suite, --scaling,"
+                             " --drift and --sweep, at --hz."
+                             " [Default: %(default)s]")
+    parser.add_argument('--suite', nargs='*', choices=sorted(SCENES), metavar='SCENE',
+                        help="Run the benchmark suite on the named scenes, or all."
+                             " Choices: %s" % ", ".join(sorted(SCENES)))
+    parser.add_argument('--scaling', type=int, nargs='?', const=20000, metavar='MAX',
+                        help="Run the ball count scaling study, from 10 balls"
+                             " doubling up to MAX. [Default MAX: %(const)s]")
+    parser.add_argument('--drift', nargs='*', choices=sorted(SCENES), metavar='SCENE',
+                        help="Compare the integrators on energy drift and cost per step"
+                             " on the named scenes, or all, at %s Hz" % ", ".join(
+                             str(_) for _ in DRIFT_HZ))
+    parser.add_argument('--sweep', type=grid, nargs='+', metavar='PARAM=VALUES',
+                        help="Run every combination of the parameter grid headless,"
+                             " in parallel. PARAM is one of %s, VALUES a comma"
+                             " separated list. Integers may be FIRST..LAST ranges,"
+                             " radius MIN:MAX, vel and damping X:Y" % ", ".join(SWEEP))
+    parser.add_argument('--budget', type=float, metavar='SECONDS',
+                        help="Stop each --sweep run after SECONDS, even if short of"
+                             " --frames")
+    parser.add_argument('--workers', type=int,
+                        help="Processes running --sweep. [Default: one per core]")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="Random seed of --suite, --scaling, --drift and --sweep."
+                             " [Default: %(default)s]")
+    parser.add_argument('--output', metavar='FILE',
+                        help="Write --suite, --scaling or --drift results as JSON"
+                             " to FILE instead of stdout. --sweep appends JSON"
+                             " lines, resuming after the runs already there")
+    args = parser.parse_args(argv)
+    if np is None and (args.color != "ball" or args.suite is not None or args.scaling or
+                       args.drift is not None):
+        parser.error("NumPy is required by --color speed and energy, --suite, --scaling"
+                     " and --drift")
+    return args
 
 
 def main(*argv):
     """ Main Program """
-    global screen, background, balls, args, FPS
-
-    # Soon to be replaced by a proper argparse
-    args = Args(fullscreen="--fullscreen" in argv or FULLSCREEN,
-                benchmark="--benchmark" in argv or BENCHMARK,
-                debug="--debug" in argv or DEBUG)
-    if args.benchmark:
-        FPS = 0
+    global screen, background, stamps, palette, renderer
+
+    args = parse_args(argv)
+    if args.suite is not None:
+        return benchmark(args)
+    if args.scaling:
+        return scaling(args)
+    if args.drift is not None:
+        return drift(args)
+    if args.sweep:
+        return sweep(args)
+    if args.headless:
+        return headless(args)
 
     pygame.display.init()
 
@@ -311,21 +3016,21 @@ def main(*argv):
         flags |= pygame.FULLSCREEN | pygame.HWSURFACE | pygame.DOUBLEBUF
         size = (0, 0)  # current desktop resolution
     screen = pygame.display.set_mode(size, flags)
+    if args.color != "ball":
+        palette = Palette(args.color)
+    stamps = StampCache(args.stamp_budget * 2**20, palette and palette.colors)
 
     # Set the background
     background = pygame.Surface(screen.get_size())
     background.fill(BG_COLOR)
     screen.blit(background, (0,0))
+    renderer = Renderer(screen, background, args.dirty_max)
 
-    # Create the balls
-    balls = pygame.sprite.RenderUpdates()
-    for __ in range(BALLS):
-        balls.add(Ball(color=(randint(0,255), randint(0,255), randint(0,255)),
-                       radius=randint(10, radius), elasticity=elast,
-                       position=[randint(100, screen.get_size()[0]-radius),
-                                 randint(100, screen.get_size()[1]-radius)],
-                       velocity=[randint(-vel[0], vel[0]), randint(-vel[0], vel[1])],
-                       ))
+    # Create the world and its balls
+    world = World(screen.get_size(), **world_options(args))
+    balls = world.populate(args.balls)
+    physics, timestep = world.physics, world.timestep
+    fps = 0 if args.benchmark else args.fps
 
     # -------- Main Game Loop -----------
     if args.benchmark:
@@ -342,15 +3047,11 @@ def main(*argv):
             if Point2(x, y).intersect(circle):
                 return ball
 
-    def energy_momentum(balls):
-        # Calculate kinetic energy and linear momentum
+    def energy_momentum(physics):
+        # Kinetic plus potential energy and linear momentum, from the running totals
         # P must be always constant, also E if damping is 1
-        P = Vector2(0, 0)
-        E = 0
-        for ball in balls:
-            p = ball.momentum
-            P += (p + ball.wallp) if abs(p) > EPSILON else (0, 0)
-            E += ball.knectic + ball.potential
+        E = physics.energy
+        P = list(physics.momentum)
         if -EPSILON < E    < EPSILON: E    = 0
         if -EPSILON < P[0] < EPSILON: P[0] = 0
         if -EPSILON < P[1] < EPSILON: P[1] = 0
@@ -358,27 +3059,23 @@ def main(*argv):
 
     def update_caption():
         if not args.fullscreen:
-            E, P = energy_momentum(balls)
+            E, P = energy_momentum(physics)
             pygame.display.set_caption(
-                "%s - FPS: %02d - Energy: % .3e, Momentum: [% .3e, % .3e]" % (
-                caption, clock.get_fps(), E, P[0], P[1]))
+                "%s - FPS: %02.0f - Energy: % .3e, Momentum: [% .3e, % .3e]%s" % (
+                caption, clock.get_fps(), E, P[0], P[1],
+                (" - %s" % physics.stats) if args.stats else ""))
 
     def render(clear=False):
-        if not trace:
-            balls.clear(screen, background)
-        if clear:
-            screen.blit(background, (0, 0))
-        updates = balls.draw(screen)
-        if clear:
-            updates = screen.get_rect()
-        pygame.display.update(updates)
+        if palette is not None:
+            palette.recolor(physics)
+        renderer.render(physics, clear, trace)
 
     # draw t=0
     clock = pygame.time.Clock()
-    balls.update(0)
+    world.start()
     render(True)
     update_caption()
-    clock.tick(FPS)
+    clock.tick(fps)
 
     selected = None
     rendertimes = []
@@ -387,8 +3084,21 @@ def main(*argv):
     frames = 0  # not absolute! Gets reset at intervals
     clear = False
     done = False
+    accumulator = 0  # Real time not yet simulated, in seconds
+    last = time.time()
+    idle = False
     while not done:
-        for event in pygame.event.get():
+        if idle:
+            # Nothing can change: block until input arrives or the wake-up timer fires
+            pygame.time.set_timer(WAKEUP, IDLE_WAKE)
+            events = [pygame.event.wait()] + pygame.event.get()
+            pygame.time.set_timer(WAKEUP, 0)
+            last = time.time()  # Idle time is not simulated
+        else:
+            events = pygame.event.get()
+        now = time.time()
+        elapsed, last = now - last, now
+        for event in events:
             if (event.type == pygame.QUIT or
                 event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
                 done = True
@@ -401,12 +3111,17 @@ def main(*argv):
                     if not args.benchmark:
                         play = not play
                         if not play:
-                            balls.sprites()[0].printdata("Paused")
+                            balls[0].printdata("Paused")
+                if event.key == pygame.K_TAB:
+                    names = sorted(BROADPHASES)
+                    args.broadphase = names[(names.index(args.broadphase) + 1) % len(names)]
+                    world.broadphase = BROADPHASES[args.broadphase](physics)
+                    print("Broad-phase: %s" % args.broadphase)
                 if event.key == pygame.K_SPACE:
                     if not args.benchmark:
                         if play:
                             play = False
-                            balls.sprites()[0].printdata("Paused")
+                            balls[0].printdata("Paused")
                         else:
                             play = step = True
 
@@ -419,23 +3134,35 @@ def main(*argv):
                     selected.deselect()
                 selected = None
 
-        if play:
+        # Paused, or a scene where every ball rests, needs no physics nor rendering.
+        # A clear requested while paused waits for play to resume
+        idle = (not args.benchmark and not selected and not step and
+                (not play or not clear and physics.resting))
+
+        if play and not idle:
 
             if selected:
                 (mouseX, mouseY) = pygame.mouse.get_pos()
                 dx = mouseX - selected.rect.centerx
                 dy = mouseY - selected.rect.centery
                 selected.velocity = Vector2(dx, -dy) * 10. / SCALE
-
-            # Update
-            t1 = pygame.time.get_ticks()
-            balls.update()  # real dt: elapsed/1000.
-
-            # Collision detection and resolution
-            balllist = list(balls)
-            for i, ball in enumerate(balllist[:-1]):
-                for other in pygame.sprite.spritecollide(ball, balllist[i+1:], False):
-                    ball.collide(other)
+                selected.wake()
+
+            # Physics advances in whole steps, while there is real time to simulate
+            # A single step when stepping frame by frame
+            accumulator = timestep if step else min(accumulator + elapsed,
+                                                    MAX_STEPS * timestep)
+            if accumulator >= timestep:
+                physics.stats.reset()
+            while accumulator >= timestep:
+                t1 = time.time()
+                world.step()
+                if args.benchmark:
+                    updatetimes.append(1000 * (time.time() - t1))
+                accumulator -= timestep
+
+            # Render between the last two states, as real time is ahead of physics
+            physics.interpolate(1 if step else accumulator / timestep)
 
             # Draw
             t2 = pygame.time.get_ticks()
@@ -445,34 +3172,25 @@ def main(*argv):
             frames += 1
 
             if args.benchmark:
-                updatetimes.append(t2 - t1)
                 rendertimes.append(t3 - t2)
-                if frames % 15 == 0:
+                if frames % 15 == 0 and not math.isinf(clock.get_fps()):
                     fpslist.append(clock.get_fps())
                 if pygame.time.get_ticks() > 10000:
                     done = True
 
-            if frames == (FPS or 100):
+            if frames == (fps or 100):
                 frames = 0
                 update_caption()
 
             if step:
                 play = step = False
-                balls.sprites()[0].printdata("Frame")
+                balls[0].printdata("Frame")
 
-        clock.tick(FPS)
+        if not idle:
+            clock.tick(fps)
 
     if args.benchmark and fpslist :
-        def printtimes(name, times, limit, lowerisbetter=False):
-            fail = sum(1 for x in times if (x<limit if lowerisbetter else x>limit))
-            total = len(times)
-            failp = 100. * fail / total
-            print(("%s: " + 6*"%3d  ") % (
-                name, min(times), sum(times)/total, max(times), limit, fail, failp))
-        print(     "t (ms): min, avg, max, top, fail   %")
-        printtimes("Update", updatetimes, TIMESTEP*1000)
-        printtimes("Render", rendertimes, TIMESTEP*1000)
-        printtimes("FPS   ", fpslist, 1./TIMESTEP, True)
+        print_benchmark(updatetimes, rendertimes, fpslist, world.broadphase, timestep, fps)
 
     pygame.quit()
     return True